@@ -0,0 +1,86 @@
+""" Measures /metrics of APACHE_EXPORTER_TARGETS mode with 1 to N processes.
+
+Every target serves the same generated page from the stub server, so
+the time goes to parsing. With 1 process targets are parsed in threads
+of the exporter process, with more they are split between worker
+processes (APACHE_EXPORTER_PROCESSES).
+
+    python benchmark/bench_processes.py --targets 8 --processes 4 """
+import os
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import requests
+import fixtures
+from replay import StubApache, SUBSTRACT_RULES, summary
+from bench_startup import start_exporter, EXPORTER_URL
+
+
+def bench_processes(env, processes, iterations):
+    process, startup = start_exporter(
+        dict(env, APACHE_EXPORTER_PROCESSES=str(processes))
+    )
+    try:
+        session = requests.Session()
+        #  Workers import modules and build collectors on the first scrape
+        session.get(EXPORTER_URL + '/metrics').raise_for_status()
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            scrape_start = time.perf_counter()
+            response = session.get(EXPORTER_URL + '/metrics')
+            latencies.append(time.perf_counter() - scrape_start)
+            response.raise_for_status()
+        result = summary(latencies, time.perf_counter() - start)
+        result['response_kb'] = round(len(response.content) / 1024.0, 1)
+        result['startup_ms'] = round(startup * 1000, 1)
+        return result
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=10)
+    parser.add_argument('--scenario', default='big-worker',
+                        choices=sorted(fixtures.SCENARIOS))
+    parser.add_argument('--targets', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='maximum number of processes')
+    args = parser.parse_args()
+
+    scenario = fixtures.SCENARIOS[args.scenario]
+    stub = StubApache(fixtures.status_page(*scenario))
+    env = {
+        'APACHE_EXPORTER_NAME': args.scenario,
+        'APACHE_URL_SUBSTRACT_RULES': json.dumps(SUBSTRACT_RULES),
+        'APACHE_ENDPOINT_STATISTICS': 'true',
+        'APACHE_EXPORTER_CONCURRENCY': str(args.targets),
+    }
+    print('%d cores, %d targets of %s' % (os.cpu_count(), args.targets,
+                                          args.scenario))
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as targets:
+        json.dump([{'name': 'target%d' % i, 'url': '%s?%d' % (stub.url, i)}
+                   for i in range(args.targets)], targets)
+        targets.flush()
+        env['APACHE_EXPORTER_TARGETS'] = targets.name
+        baseline = None
+        for processes in range(1, args.processes + 1):
+            result = bench_processes(env, processes, args.iterations)
+            baseline = baseline or result['throughput']
+            result['speedup'] = round(result['throughput'] / baseline, 2)
+            print('processes=%-3d %s' % (processes, ' '.join(
+                '%s=%s' % item for item in sorted(result.items()))))
+    stub.stop()
+
+
+if __name__ == '__main__':
+    main()
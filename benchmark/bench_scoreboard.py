@@ -0,0 +1,129 @@
+""" Checks and measures scoreboard counting.
+
+Scoreboards of 10k to 100k slots are printed the way the status page
+prints them, 64 slots per line with a few symbols mod_status does not
+document. Counts of Collector.count_scoreboard must match the previous
+per-character dict loop. Then both are timed, together with the
+per-process breakdown of APACHE_SCOREBOARD_THREAD_LIMIT.
+
+    python benchmark/bench_scoreboard.py --threads 64 """
+import os
+import sys
+import random
+import timeit
+import argparse
+
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'prometheus-apache-exporter'))
+
+from collector import Collector
+
+SIZES = (10000, 25000, 50000, 100000)
+
+
+def legacy_count(text):
+    """ Scoreboard loop of Collector.collect before count_scoreboard,
+    returns status -> count """
+    workers_map = {}
+    workers = text.strip()
+    for symbol in range (0,len(workers)):
+        if workers[symbol] in workers_map:
+            workers_map[workers[symbol]] += 1
+        else:
+            workers_map[workers[symbol]] = 1
+    result = {}
+    for worker_status in workers_map:
+        if worker_status == ".":
+            status = "Open slot"
+        elif worker_status == "_":
+            status = "Waiting for Connection"
+        elif worker_status == "S":
+            status = "Starting up"
+        elif worker_status == "R":
+            status = "Reading Request"
+        elif worker_status == "W":
+            status = "Sending Reply"
+        elif worker_status == "K":
+            status = "Keepalive"
+        elif worker_status == "D":
+            status = "DNS Lookup"
+        elif worker_status == "C":
+            status = "Closing connection"
+        elif worker_status == "L":
+            status = "Logging"
+        elif worker_status == "G":
+            status = "Gracefully finishing"
+        elif worker_status == "I":
+            status = "Idle cleanup of worker"
+        else:
+            status = "Unknown"
+        if worker_status != "\n":
+            #  Several unknown symbols gave duplicate samples, they are
+            #  summed here to compare totals
+            result[status] = result.get(status, 0) \
+                + workers_map[worker_status]
+    return result
+
+
+def count(text):
+    """ Scoreboard stage of Collector.collect_page """
+    return Collector.count_scoreboard(''.join(text.split()))
+
+
+def count_processes(text, threads):
+    """ Per-process stage of Collector.collect_page """
+    workers = ''.join(text.split())
+    return [[(status, n) for status, n in
+             Collector.count_scoreboard(workers[process:process + threads])
+             if n]
+            for process in range(0, len(workers), threads)]
+
+
+def page_scoreboard(rnd, slots):
+    """ Text of the scoreboard <pre> element """
+    board = list(fixtures.scoreboard(slots, rnd.randint(0, 10**6)))
+    for _ in range(slots // 1000):
+        board[rnd.randrange(slots)] = rnd.choice('XZ')
+    board = ''.join(board)
+    return '\n'.join(board[i:i + 64] for i in range(0, slots, 64)) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=64,
+                        help='APACHE_SCOREBOARD_THREAD_LIMIT of the breakdown')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    failures = []
+    for slots in SIZES:
+        text = page_scoreboard(rnd, slots)
+        counts = dict(count(text))
+        expected = legacy_count(text)
+        if any(counts[status] != expected.get(status, 0)
+               for status in counts) or set(expected) - set(counts):
+            failures.append(f'{slots} slots: {counts}, expected {expected}')
+        processes = count_processes(text, args.threads)
+        if sum(n for process in processes for _, n in process) != slots:
+            failures.append(f'{slots} slots: processes do not add up')
+
+        result = []
+        for name, function in (
+                ('legacy', lambda: legacy_count(text)),
+                ('count_scoreboard', lambda: count(text)),
+                ('processes', lambda: count_processes(text, args.threads))):
+            duration = timeit.timeit(function, number=args.iterations)
+            milliseconds = duration / args.iterations * 1000
+            result.append(f'{name}_ms={milliseconds:.2f}')
+        print(f'slots={slots:<7} ' + ' '.join(result))
+    for failure in failures:
+        print('  ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
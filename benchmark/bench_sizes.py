@@ -0,0 +1,172 @@
+""" Checks and measures sizes.parse_size.
+
+Sizes formatted the way mod_status prints them (apr_strfsize for
+balancer tables, format_byte_out and format_kbyte_out for totals and
+rates) must parse back within the rounding of the printed value, other
+strings must raise ValueError. Totals lines with and without the
+Total Duration of httpd 2.4.35+ must give back their traffic. Then
+parse_size is timed against the previous Collector.str_to_bytes.
+
+    python benchmark/bench_sizes.py -n 100000 """
+import os
+import sys
+import random
+import string
+import timeit
+import argparse
+
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'prometheus-apache-exporter'))
+
+from sizes import parse_size
+from collector import TOTALS_RE
+
+UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40, 'P': 2**50}
+
+
+def legacy_str_to_bytes(str):
+    """ Collector.str_to_bytes before sizes.parse_size """
+    str = str.upper()
+    res = 0
+
+    pos = str.find('K')
+    if pos > 0:
+        res = float(str[0:pos].strip()) * 2**10
+        return res
+    pos = str.find('M')
+    if pos > 0:
+        res = float(str[0:pos].strip()) * 2**20
+        return res
+    pos = str.find('G')
+    if pos > 0:
+        res = float(str[0:pos].strip()) * 2**30
+        return res
+    pos = str.find('B')
+    if pos > 0:
+        res = float(str[0:pos].strip())
+        return res
+
+    return res
+
+
+def tolerance(text):
+    """ Largest rounding error of a printed size. apr_strfsize rounds
+    the fraction but truncates the unit below """
+    unit = 1
+    for symbol, value in UNITS.items():
+        if symbol in text.upper():
+            unit = value
+    return unit * (0.05 if '.' in text else 0.5) + unit / 1024 + 1
+
+
+def random_size(rnd):
+    return int(2 ** rnd.uniform(0, 52))
+
+
+def fuzz_sizes(rnd, count):
+    """ Return (checked, failures, legacy failures) """
+    formats = [
+        (fixtures.strfsize, lambda size: size),
+        (fixtures.byte_out, lambda size: size),
+        (fixtures.kbyte_out, lambda size: size * 2**10),
+    ]
+    failures, legacy = [], 0
+    for _ in range(count):
+        size = random_size(rnd)
+        for format_size, expected in formats:
+            if format_size is fixtures.kbyte_out:
+                size_kb = size >> 10
+                text, value = format_size(size_kb), expected(size_kb)
+            else:
+                text, value = format_size(size), expected(size)
+            limit = tolerance(text)
+            try:
+                parsed = parse_size(text)
+            except ValueError as e:
+                failures.append(str(e))
+                continue
+            if abs(parsed - value) > limit:
+                failures.append(f'{text!r} parsed as {parsed}, '
+                                f'expected {value}')
+            if abs(legacy_str_to_bytes(text) - value) > limit:
+                legacy += 1
+    return count * len(formats), failures, legacy
+
+
+def fuzz_totals(rnd, count):
+    """ Return (checked, failures) of status page totals lines """
+    failures = []
+    for _ in range(count):
+        kbytes = random_size(rnd) >> 10
+        duration = rnd.choice([None, rnd.randint(0, 10**9)])
+        line = fixtures.totals_line(rnd.randint(0, 10**9), kbytes, duration)
+        match = TOTALS_RE.match(line)
+        try:
+            parsed = parse_size(match.group(2))
+        except (AttributeError, ValueError) as e:
+            failures.append(f'{line!r} raised {e!r}')
+            continue
+        text = fixtures.kbyte_out(kbytes)
+        if abs(parsed - kbytes * 2**10) > tolerance(text):
+            failures.append(f'{line!r} parsed as {parsed}, '
+                            f'expected {kbytes * 2**10}')
+    return count, failures
+
+
+def fuzz_garbage(rnd, count):
+    """ Random strings must either parse or raise ValueError """
+    alphabet = string.digits + ' .-/kKMGTPEBbx'
+    failures = []
+    for _ in range(count):
+        text = ''.join(rnd.choice(alphabet)
+                       for _ in range(rnd.randint(0, 8)))
+        try:
+            parse_size(text)
+        except ValueError:
+            pass
+        except Exception as e:
+            failures.append(f'{text!r} raised {e!r}')
+    return count, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=100000)
+    parser.add_argument('--fuzz', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    checked, failures, legacy = fuzz_sizes(rnd, args.fuzz)
+    print(f'mod_status sizes  checked={checked} failed={len(failures)} '
+          f'legacy_failed={legacy}')
+    totals, totals_failures = fuzz_totals(rnd, args.fuzz)
+    failures.extend(totals_failures)
+    print(f'totals lines      checked={totals} '
+          f'failed={len(totals_failures)}')
+    garbage, garbage_failures = fuzz_garbage(rnd, args.fuzz)
+    failures.extend(garbage_failures)
+    print(f'random strings    checked={garbage} '
+          f'failed={len(garbage_failures)}')
+    for failure in failures[:20]:
+        print('  ' + failure)
+
+    #  Cells of a balancer table, most of them repeat between scrapes
+    cells = [fixtures.strfsize(random_size(rnd)) for _ in range(500)]
+    parse_size.cache_clear()
+    for name, function in (('legacy', legacy_str_to_bytes),
+                           ('parse_size', parse_size),
+                           ('uncached', parse_size.__wrapped__)):
+        duration = timeit.timeit(
+            lambda: [function(cell) for cell in cells],
+            number=max(1, args.iterations // len(cells))
+        )
+        calls = max(1, args.iterations // len(cells)) * len(cells)
+        print(f'{name:<17} ns_per_call={duration / calls * 1e9:.0f}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
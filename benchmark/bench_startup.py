@@ -0,0 +1,202 @@
+""" Runs application.py against the stub server and checks its lifecycle.
+
+For every mode it measures the time until /healthz/up answers and checks
+that Apache is not fetched on start, that every /metrics request fetches
+the status page of every target once and that SIGTERM stops the exporter
+after the scrape in flight. With Apache down /metrics has to answer
+apache_up 0 without waiting for the timeout once the breaker is open.
+
+    python benchmark/bench_startup.py -n 10 """
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import requests
+import fixtures
+from replay import StubApache, SUBSTRACT_RULES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'src', 'prometheus-apache-exporter')
+EXPORTER_URL = 'http://127.0.0.1:9345'
+
+
+def start_exporter(env, timeout=30):
+    """ Start application.py, return the process and startup seconds """
+    start = time.perf_counter()
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, 'application.py'], cwd=SOURCE,
+        env=dict(os.environ, **env), stdout=log, stderr=subprocess.STDOUT
+    )
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError('Exporter exited with %d:\n%s' % (
+                process.returncode, log.read().decode()))
+        try:
+            requests.get(EXPORTER_URL + '/healthz/up', timeout=1)
+            return process, time.perf_counter() - start
+        except requests.ConnectionError:
+            time.sleep(0.01)
+    process.kill()
+    raise RuntimeError('Exporter did not start in %ds' % timeout)
+
+
+def stop_exporter(process, stub, timeout=10):
+    """ Send SIGTERM while a scrape is in flight, return exit code and
+    whether the scrape was answered """
+    session = requests.Session()
+    stub.delay = 0.5
+    hits = stub.hits
+    answered = []
+
+    def scrape():
+        try:
+            answered.append(
+                session.get(EXPORTER_URL + '/metrics').status_code == 200
+            )
+        except requests.RequestException:
+            answered.append(False)
+
+    scraper = threading.Thread(target=scrape)
+    scraper.start()
+    while stub.hits == hits:
+        time.sleep(0.01)
+    process.send_signal(signal.SIGTERM)
+    try:
+        code = process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        code = None
+    scraper.join()
+    stub.delay = 0
+    return code, bool(answered and answered[0])
+
+
+def check_mode(name, env, targets, stub, iterations):
+    """ Return the mode report and list of failures """
+    failures = []
+    hits = stub.hits
+    process, startup = start_exporter(env)
+    try:
+        startup_fetches = stub.hits - hits
+        session = requests.Session()
+        hits = stub.hits
+        for _ in range(iterations):
+            response = session.get(EXPORTER_URL + '/metrics')
+            response.raise_for_status()
+        fetches = (stub.hits - hits) / float(iterations * targets)
+        encoded = [line for line in response.text.splitlines()
+                   if line.startswith('apache_exporter_encoded_bytes_total')]
+    finally:
+        code, answered = stop_exporter(process, stub)
+
+    if startup_fetches:
+        failures.append(f'{name}: {startup_fetches} fetches on start')
+    if fetches != 1:
+        failures.append(f'{name}: {fetches} fetches per scrape and target')
+    #  Exposition is counted by collectors of single targets only
+    if targets == 1 and (not encoded
+                         or any(line.endswith(' 0.0') for line in encoded)):
+        failures.append(f'{name}: exposition of scrapes is not counted')
+    if code != 0 or not answered:
+        failures.append(f'{name}: exit code {code} on SIGTERM, '
+                        f'scrape in flight answered: {answered}')
+    return {
+        'startup_ms': round(startup * 1000, 1),
+        'startup_fetches': startup_fetches,
+        'fetches_per_scrape': fetches,
+        'exit_code': code,
+    }, failures
+
+
+def check_outage(env, iterations):
+    """ Scrape an exporter of a closed port, return the report and list
+    of failures """
+    failures = []
+    #  Nothing listens on the port of a socket which was just closed
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    url = 'http://127.0.0.1:%d/server-status' % sock.getsockname()[1]
+    sock.close()
+    process, _ = start_exporter(dict(env, APACHE_EXPORTER_URL=url))
+    try:
+        session = requests.Session()
+        latencies, codes = [], set()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            response = session.get(EXPORTER_URL + '/metrics')
+            latencies.append(time.perf_counter() - start)
+            codes.add(response.status_code)
+        ready = session.get(EXPORTER_URL + '/healthz/ready').status_code
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(10)
+
+    if codes != {200}:
+        failures.append(f'outage: /metrics answered {sorted(codes)}')
+    elif 'apache_up{exporter_name="%s"} 0.0' % env['APACHE_EXPORTER_NAME'] \
+            not in response.text:
+        failures.append('outage: apache_up 0 is not exported')
+    if ready != 503:
+        failures.append(f'outage: readiness answered {ready}')
+    return {
+        'max_ms': round(max(latencies) * 1000, 1),
+        'ready': ready,
+    }, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=10)
+    parser.add_argument('--scenario', default='small-prefork',
+                        choices=sorted(fixtures.SCENARIOS))
+    args = parser.parse_args()
+
+    scenario = fixtures.SCENARIOS[args.scenario]
+    stub = StubApache(fixtures.status_page(*scenario),
+                      fixtures.auto_page(*scenario))
+    env = {
+        'APACHE_EXPORTER_URL': stub.url,
+        'APACHE_EXPORTER_NAME': args.scenario,
+        'APACHE_URL_SUBSTRACT_RULES': json.dumps(SUBSTRACT_RULES),
+        'APACHE_ENDPOINT_STATISTICS': 'true',
+    }
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as targets:
+        json.dump([{'name': 'first', 'url': stub.url},
+                   {'name': 'second', 'url': stub.url + '?second'}], targets)
+        targets.flush()
+        modes = (
+            ('sync', {}, 1),
+            ('async', {'APACHE_EXPORTER_ASYNC': 'true'}, 1),
+            ('targets', {'APACHE_EXPORTER_TARGETS': targets.name}, 2),
+            ('shards', {'APACHE_EXPORTER_TARGETS': targets.name,
+                        'APACHE_EXPORTER_PROCESSES': '2'}, 2),
+        )
+        failures = []
+        for name, mode_env, count in modes:
+            result, mode_failures = check_mode(
+                name, dict(env, **mode_env), count, stub, args.iterations
+            )
+            failures.extend(mode_failures)
+            print('%-8s %s' % (name, ' '.join(
+                '%s=%s' % item for item in sorted(result.items()))))
+    result, mode_failures = check_outage(env, args.iterations)
+    failures.extend(mode_failures)
+    print('%-8s %s' % ('outage', ' '.join(
+        '%s=%s' % item for item in sorted(result.items()))))
+    stub.stop()
+    for failure in failures:
+        print('  ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
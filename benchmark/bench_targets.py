@@ -0,0 +1,134 @@
+""" Measures memory and CPU per target of APACHE_EXPORTER_TARGETS mode
+against separate single-target exporters.
+
+M targets are scraped by one exporter, then every target by an exporter
+of its own. Exporters listen on the same port, so single-target ones are
+run one after another, their RSS and CPU time are summed. RSS and CPU
+time are read from /proc of the exporter and its worker processes,
+Linux only.
+
+    python benchmark/bench_targets.py --targets 8 -n 20 """
+import os
+import json
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import requests
+import fixtures
+from replay import StubApache, SUBSTRACT_RULES
+from bench_startup import start_exporter, EXPORTER_URL
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def process_tree(pid):
+    """ Return pid and pids of its descendants """
+    pids = [pid]
+    try:
+        for task in os.listdir('/proc/%d/task' % pid):
+            with open('/proc/%d/task/%s/children' % (pid, task)) as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def cpu_seconds(pids):
+    """ User and system CPU time of the processes """
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += int(fields[11]) + int(fields[12])
+        except OSError:
+            pass
+    return total / float(CLOCK_TICKS)
+
+
+def rss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open('/proc/%d/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024.0
+
+
+def measure(env, iterations):
+    """ Start an exporter, return its RSS after the scrapes and CPU
+    seconds the scrapes took """
+    process, _ = start_exporter(env)
+    try:
+        session = requests.Session()
+        session.get(EXPORTER_URL + '/metrics').raise_for_status()
+        pids = process_tree(process.pid)
+        cpu = cpu_seconds(pids)
+        for _ in range(iterations):
+            session.get(EXPORTER_URL + '/metrics').raise_for_status()
+        return rss_mb(pids), cpu_seconds(pids) - cpu
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def report(name, count, iterations, rss, cpu):
+    print('%-10s rss_mb=%.1f rss_mb_per_target=%.1f '
+          'cpu_ms_per_target_scrape=%.2f' % (
+              name, rss, rss / count, cpu / (count * iterations) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    parser.add_argument('--scenario', default='small-prefork',
+                        choices=sorted(fixtures.SCENARIOS))
+    parser.add_argument('--targets', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='APACHE_EXPORTER_PROCESSES of the exporter '
+                             'of all targets')
+    args = parser.parse_args()
+
+    stub = StubApache(fixtures.status_page(*fixtures.SCENARIOS[args.scenario]))
+    env = {
+        'APACHE_EXPORTER_NAME': args.scenario,
+        'APACHE_URL_SUBSTRACT_RULES': json.dumps(SUBSTRACT_RULES),
+        'APACHE_ENDPOINT_STATISTICS': 'true',
+        'APACHE_EXPORTER_CONCURRENCY': str(args.targets),
+    }
+    urls = ['%s?%d' % (stub.url, i) for i in range(args.targets)]
+    print('%d targets of %s, %d scrapes' % (args.targets, args.scenario,
+                                           args.iterations))
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as targets:
+        json.dump([{'name': 'target%d' % i, 'url': url}
+                   for i, url in enumerate(urls)], targets)
+        targets.flush()
+        rss, cpu = measure(dict(
+            env, APACHE_EXPORTER_TARGETS=targets.name,
+            APACHE_EXPORTER_PROCESSES=str(args.processes)
+        ), args.iterations)
+        report('targets', args.targets, args.iterations, rss, cpu)
+
+    rss, cpu = 0, 0
+    for i, url in enumerate(urls):
+        target_rss, target_cpu = measure(dict(
+            env, APACHE_EXPORTER_URL=url, APACHE_EXPORTER_NAME='target%d' % i
+        ), args.iterations)
+        rss += target_rss
+        cpu += target_cpu
+    report('separate', args.targets, args.iterations, rss, cpu)
+    stub.stop()
+
+
+if __name__ == '__main__':
+    main()
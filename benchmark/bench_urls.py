@@ -0,0 +1,135 @@
+""" Checks and measures urlrules.UrlNormalizer.
+
+Random substract rule sets are applied to random request lines with
+and without the protocol, the compiled rules must cut their paths
+exactly as the previous per-rule find loop of Collector.sanitize_url.
+Then worker table request lines are normalized by the previous loop, by
+UrlNormalizer without its cache and with it.
+
+    python benchmark/bench_urls.py -n 100000 """
+import os
+import sys
+import random
+import timeit
+import argparse
+
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'prometheus-apache-exporter'))
+
+from urlrules import UrlNormalizer
+
+METHODS = ('GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE')
+PARAMETERS = ('?page=%d', '?id=%d&sort=name', ';jsessionid=%d', '', '')
+#  Request lines of mod_status end with the protocol unless truncated
+PROTOCOLS = (' HTTP/1.1', ' HTTP/1.0', ' HTTP/2.0', '')
+
+
+def legacy_sanitize_url(url_substract_rules, input_url):
+    """ Collector.sanitize_url before urlrules.UrlNormalizer """
+    if input_url == 'NULL' or input_url == '..reading..' \
+        or input_url.find(" ") == -1:
+        return None, None
+    if url_substract_rules is None:
+        return None, None
+
+    #  split into method and url
+    method, tmp = input_url.split(sep=" ", maxsplit=1)
+
+    #  take first 5 contexts
+    url = ""
+    url_parts = tmp.strip().split(sep="/", maxsplit=6)
+    for x in url_parts[1:5]:
+        url += "/%s" % x
+
+    #  remove dymanic content
+    for rule in url_substract_rules:
+        pos = url.find(rule)
+        if pos >= 0:
+            url = url[0:pos+len(rule)]
+
+    return method, url
+
+
+def request_line(rnd):
+    """ Request of a worker table row """
+    request = rnd.choice(fixtures.REQUESTS)
+    if '%d' in request:
+        request = request % rnd.randint(1, 500)
+    if ' ' not in request:
+        return request
+    method, url = rnd.choice(METHODS), request.split()[1].split('?')[0]
+    parameters = rnd.choice(PARAMETERS)
+    if '%d' in parameters:
+        parameters = parameters % rnd.randint(1, 10**6)
+    return '%s %s%s HTTP/1.1' % (method, url, parameters)
+
+
+def rules(rnd, count):
+    """ Substract rules of real configurations and generated prefixes """
+    result = ['?', ';', ' HTTP', '/static/', '/img/']
+    while len(result) < count:
+        result.append('/%s/' % rnd.choice(['api/v1', 'api/v2', 'catalog',
+                                            'orders', 'users', 'items'])
+                      + rnd.choice(['', 'x', 'list', str(len(result))]))
+    return result
+
+
+def fuzz_rules(rnd, count):
+    """ Return (checked, failures) of random rules and urls. The previous
+    loop is given the request line without the protocol, which it
+    treated as a part of the url """
+    alphabet = '/?;=&.ab01'
+    failures = []
+    for _ in range(count):
+        substract = [''.join(rnd.choice(alphabet + ' ')
+                             for _ in range(rnd.randint(1, 3)))
+                     for _ in range(rnd.randint(1, 5))]
+        path = ''.join(rnd.choice(alphabet)
+                       for _ in range(rnd.randint(0, 24)))
+        request = 'GET ' + path + rnd.choice(PROTOCOLS)
+        expected = legacy_sanitize_url(substract, 'GET ' + path)
+        result = UrlNormalizer(substract)._normalize(request)
+        if result != expected:
+            failures.append(f'{request!r} with {substract!r}: {result}, '
+                            f'expected {expected}')
+    return count, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=100000)
+    parser.add_argument('--fuzz', type=int, default=20000)
+    parser.add_argument('--rules', type=int, default=40)
+    parser.add_argument('--distinct', type=int, default=1000,
+                        help='distinct request lines of the worker table')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    checked, failures = fuzz_rules(rnd, args.fuzz)
+    print(f'random rules      checked={checked} failed={len(failures)}')
+    for failure in failures[:20]:
+        print('  ' + failure)
+
+    #  Rows of a worker table, busy workers repeat the same requests
+    substract = rules(rnd, args.rules)
+    lines = [request_line(rnd) for _ in range(args.distinct)]
+    rows = [rnd.choice(lines) for _ in range(5000)]
+    normalizer = UrlNormalizer(substract)
+    for name, function in (
+            ('legacy', lambda row: legacy_sanitize_url(substract, row)),
+            ('uncached', normalizer._normalize),
+            ('normalize', normalizer.normalize)):
+        number = max(1, args.iterations // len(rows))
+        duration = timeit.timeit(
+            lambda: [function(row) for row in rows], number=number
+        )
+        print(f'{name:<17} ns_per_call='
+              f'{duration / (number * len(rows)) * 1e9:.0f}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
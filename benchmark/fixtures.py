@@ -0,0 +1,215 @@
+""" Generates /server-status pages in mod_status 2.4 format.
+Pages are deterministic, so results are comparable between runs """
+import random
+
+SCOREBOARD_SYMBOLS = '_W.KRCLSDGI'
+
+REQUESTS = [
+    'GET /api/v1/users/%d/profile?fields=name HTTP/1.1',
+    'POST /api/v1/orders/%d/items;jsessionid=abc HTTP/1.1',
+    'GET /static/img/%d.png HTTP/1.1',
+    'GET /catalog/category/%d/products?page=2 HTTP/1.1',
+    'GET /index.html HTTP/1.1',
+    'NULL',
+    '..reading..',
+]
+
+#  name -> (mpm, workers, clusters, members per cluster, httpd version)
+SCENARIOS = {
+    'small-prefork': ('prefork', 50, 1, 3, '2.4.29'),
+    'big-worker': ('worker', 20000, 2, 4, '2.4.41'),
+    'many-clusters': ('prefork', 200, 50, 10, '2.4.29'),
+}
+
+#  httpd prints request durations since this version
+DURATION_VERSION = (2, 4, 35)
+
+
+def scoreboard(workers, seed=1):
+    rnd = random.Random(seed)
+    return ''.join(rnd.choice(SCOREBOARD_SYMBOLS) for _ in range(workers))
+
+
+def size(rnd):
+    return rnd.choice(['  0 ', '512 ', '5.2K', '1.1K', ' 10M', '3.4M', '1.1G'])
+
+
+def strfsize(size):
+    """ Size of balancer Wr and Rd cells, apr_strfsize() """
+    if size < 0:
+        return '  - '
+    if size < 973:
+        return '%3d ' % size
+    for unit in 'KMGTPE':
+        remain = size & 1023
+        size >>= 10
+        if size >= 973:
+            continue
+        if size < 9 or (size == 9 and remain < 973):
+            remain = (remain * 5 + 256) // 512
+            if remain >= 10:
+                size, remain = size + 1, 0
+            return '%d.%d%s' % (size, remain, unit)
+        if remain >= 512:
+            size += 1
+        return '%3d%s' % (size, unit)
+
+
+def byte_out(size):
+    """ Bytes per second and per request, format_byte_out() of mod_status """
+    if size < 5 * 2**10:
+        return '%d B' % size
+    if size < 2**20 / 2:
+        return '%.1f kB' % (size / 2**10)
+    if size < 2**30 / 2:
+        return '%.1f MB' % (size / 2**20)
+    return '%.1f GB' % (size / 2**30)
+
+
+def kbyte_out(kbytes):
+    """ Total Traffic, format_kbyte_out() of mod_status """
+    if kbytes < 2**10:
+        return '%d kB' % kbytes
+    if kbytes < 2**20:
+        return '%.1f MB' % (kbytes / 2**10)
+    return '%.1f GB' % (kbytes / 2**20)
+
+
+def has_durations(version):
+    return tuple(int(part) for part in version.split('.')) \
+        >= DURATION_VERSION
+
+
+def totals_line(accesses, kbytes, duration=None):
+    """ Totals of the status page, duration is printed by httpd 2.4.35+ """
+    line = 'Total accesses: %d - Total Traffic: %s' % (accesses,
+                                                       kbyte_out(kbytes))
+    if duration is not None:
+        line += ' - Total Duration: %d' % duration
+    return line
+
+
+def status_page(mpm, workers, clusters, members, version='2.4.29', seed=1):
+    """ Return HTML /server-status page """
+    rnd = random.Random(seed)
+    board = scoreboard(workers, seed)
+    durations = has_durations(version)
+    out = [
+        '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN">\n'
+        '<html><head>\n<title>Apache Status</title>\n</head><body>\n'
+        '<h1>Apache Server Status for localhost (via 127.0.0.1)</h1>\n\n'
+        '<dl><dt>Server Version: Apache/%s (Ubuntu)</dt>\n'
+        '<dt>Server MPM: %s</dt>\n'
+        '<dt>Server Built: 2018-10-10T18:59:25\n</dt></dl><hr /><dl>\n'
+        '<dt>Current Time: Monday, 12-Nov-2018 10:00:00 UTC</dt>\n'
+        '<dt>Restart Time: Monday, 12-Nov-2018 09:00:00 UTC</dt>\n'
+        '<dt>Parent Server Config. Generation: 1</dt>\n'
+        '<dt>Parent Server MPM Generation: 0</dt>\n'
+        '<dt>Server uptime:  1 hour</dt>\n'
+        '<dt>Server load: 0.00 0.00 0.00</dt>\n'
+        '<dt>%s</dt>\n'
+        '<dt>CPU Usage: u.5 s.3 cu0 cs0 - .0215%% CPU load</dt>\n'
+        '<dt>342 requests/sec - 1.5 MB/second - 4.6 kB/request%s</dt>\n'
+        '<dt>%d requests currently being processed, %d idle workers</dt>\n'
+        '</dl><pre>' % (
+            version, mpm,
+            totals_line(1234567, 5872026, 98765 if durations else None),
+            ' - 80.2 ms/request' if durations else '',
+            board.count('W'), board.count('_')
+        )
+    ]
+    out.append('\n'.join(board[i:i + 64] for i in range(0, workers, 64)))
+    out.append(
+        '</pre>\n<p>Scoreboard Key:<br />\n'
+        '"<b><code>_</code></b>" Waiting for Connection</p>\n\n'
+        '<table border="0"><tr><th>Srv</th><th>PID</th><th>Acc</th>'
+        '<th>M</th><th>CPU\n</th><th>SS</th><th>Req</th><th>Conn</th>'
+        '<th>Child</th><th>Slot</th><th>Client</th><th>VHost</th>'
+        '<th>Request</th></tr>\n\n'
+    )
+    for slot in range(workers):
+        request = rnd.choice(REQUESTS)
+        if '%d' in request:
+            request = request % rnd.randint(1, 500)
+        out.append(
+            '<tr><td><b>%d-0</b></td><td>%d</td><td>0/%d/%d</td>'
+            '<td>%s\n</td><td>0.00</td><td>1</td><td>%d</td><td>0.0</td>'
+            '<td>0.00</td><td>0.00\n</td><td>10.0.%d.%d</td>'
+            '<td nowrap>localhost:80</td><td nowrap>%s</td></tr>\n\n' % (
+                slot, 1000 + slot // 25, rnd.randint(1, 99),
+                rnd.randint(100, 9999), board[slot], rnd.randint(0, 5000),
+                slot // 250 % 250, slot % 250, request
+            )
+        )
+    out.append('</table>\n')
+    for cluster in range(clusters):
+        out.append(
+            '<hr />\n<h1>Proxy LoadBalancer Status for '
+            'balancer://cluster%d</h1>\n\n'
+            '<table><tr><th>SSes</th><th>Timeout</th><th>Method</th></tr>\n'
+            '<tr><td>-</td><td>0</td><td>byrequests</td>\n</table>\n<br />\n\n'
+            '<table><tr><th>Sch</th><th>Host</th><th>Stat</th><th>Route</th>'
+            '<th>Redir</th><th>F</th><th>Set</th><th>Acc</th><th>Wr</th>'
+            '<th>Rd</th></tr>\n' % cluster
+        )
+        for member in range(members):
+            out.append(
+                '<tr><td>http</td><td>10.1.%d.%d</td><td>%s</td>'
+                '<td>node%d</td><td></td><td>1</td><td>0</td><td>%d</td>'
+                '<td>%s</td><td>%s</td></tr>\n' % (
+                    cluster, member,
+                    rnd.choice(['Init Ok ', 'Init Ok ', 'Init Dis ',
+                                'Init Err ']),
+                    member, rnd.randint(0, 10**6), size(rnd), size(rnd)
+                )
+            )
+        out.append('</table>\n')
+    out.append(
+        '<hr />\n<address>Apache/2.4.29 (Ubuntu) Server at localhost '
+        'Port 80</address>\n</body></html>\n'
+    )
+    return ''.join(out).encode()
+
+
+def auto_page(mpm, workers, clusters, members, version='2.4.29', seed=1):
+    """ Return machine-readable /server-status?auto output """
+    board = scoreboard(workers, seed)
+    durations = has_durations(version)
+    return (
+        'localhost\n'
+        'ServerVersion: Apache/%s (Ubuntu)\n'
+        'ServerMPM: %s\n'
+        'Server Built: 2018-10-10T18:59:25\n'
+        'CurrentTime: Monday, 12-Nov-2018 10:00:00 UTC\n'
+        'RestartTime: Monday, 12-Nov-2018 09:00:00 UTC\n'
+        'ParentServerConfigGeneration: 1\n'
+        'ParentServerMPMGeneration: 0\n'
+        'ServerUptimeSeconds: 3600\n'
+        'ServerUptime: 1 hour\n'
+        'Load1: 0.00\nLoad5: 0.00\nLoad15: 0.00\n'
+        'Total Accesses: 1234567\n'
+        'Total kBytes: 5872026\n'
+        '%s'
+        'CPUUser: .5\nCPUSystem: .3\nCPUChildrenUser: 0\n'
+        'CPUChildrenSystem: 0\nCPULoad: .0215\n'
+        'Uptime: 3600\n'
+        'ReqPerSec: 342\n'
+        'BytesPerSec: 1572864\n'
+        'BytesPerReq: 4710.4\n'
+        '%s'
+        'BusyWorkers: %d\n'
+        'IdleWorkers: %d\n'
+        'Scoreboard: %s\n' % (
+            version, mpm, 'Total Duration: 98765\n' if durations else '',
+            'DurationPerReq: 80.2\n' if durations else '',
+            board.count('W'), board.count('_'), board
+        )
+    ).encode()
+
+
+def cluster_xpaths(clusters):
+    """ Return APACHE_EXPORTER_CLUSTERS for status_page layout """
+    return dict(
+        ('cluster%d' % i, '/html/body/table[%d]/tr' % (3 + 2 * i))
+        for i in range(clusters)
+    )
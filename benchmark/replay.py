@@ -0,0 +1,496 @@
+""" Replays /server-status fixtures from a local stub server and
+measures the exporter: Collector.collect, /metrics end to end and
+peak memory of load, parse and collect_page stages.
+
+    python benchmark/replay.py --json before.json
+    python benchmark/replay.py --compare before.json
+    python benchmark/replay.py --async --delay 0.5 --probe-p99-ms 50
+
+Generated fixtures are used unless --html points to a captured page """
+import os
+import sys
+import gc
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import subprocess
+import tracemalloc
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'prometheus-apache-exporter'))
+
+#  Stage -> apache_latest_scrape_duration_seconds metric_name labels
+#  the stage duration is reported with, one per timed block
+STAGE_METRICS = {
+    'totals': ('apache_accesses_total', 'apache_requests_per_second'),
+    'scoreboard': ('apache_scoreboard_current',),
+    'balancer': ('apache_balancer_route_ok',),
+    'endpoints': ('apache_endpoint_response_time_seconds',),
+}
+
+SUBSTRACT_RULES = ['?', ';', ' HTTP']
+
+#  Results which are better when higher, the rest are better when lower
+HIGHER_IS_BETTER = ('throughput',)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubApache(object):
+    """ Serves a fixture as /server-status and /server-status?auto """
+    def __init__(self, html, auto=None, delay=0):
+        stub = self
+        self.hits = 0
+        self.delay = delay
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            #  Nagle with delayed ACK adds 40ms to keep-alive responses
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub.hits += 1
+                time.sleep(stub.delay)
+                if self.path.endswith('auto') and auto is not None:
+                    body = auto
+                else:
+                    body = html
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/server-status' \
+            % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ExporterServer(object):
+    """ Runs the exporter Tornado application in a background thread """
+    def __init__(self, collector):
+        import tornado.web
+        from tornado.httpserver import HTTPServer as TornadoServer
+        from tornado.ioloop import IOLoop
+        from tornado.netutil import bind_sockets
+        from collector import MetricHandler
+        from healthz import LivenessProbeHandler
+
+        application = tornado.web.Application([
+            (r"/healthz/up", LivenessProbeHandler),
+            (r"/metrics", MetricHandler, {"ref_object": collector})])
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.url = 'http://127.0.0.1:%d' % sockets[0].getsockname()[1]
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self.server = TornadoServer(application)
+            self.server.add_sockets(sockets)
+            self.loop = IOLoop.current()
+            if collector.poll_interval:
+                collector.start_polling()
+            started.set()
+            self.loop.start()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+
+
+    def stop(self):
+        def stop():
+            self.server.stop()
+            self.loop.stop()
+        self.loop.add_callback(stop)
+        self.thread.join()
+
+
+def percentile(values, q):
+    """ Nearest-rank percentile """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100.0 * len(values)))]
+
+
+def summary(values, elapsed=None):
+    result = {
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+    }
+    if elapsed:
+        result['throughput'] = round(len(values) / elapsed, 2)
+    return result
+
+
+def memory_status(field):
+    """ Return /proc/self/status field in kilobytes, Linux only """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+    return 0
+
+
+def reset_peak_rss():
+    """ Reset VmHWM to the current RSS """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except Exception:
+        pass
+
+
+def measure_stage(stage, env):
+    """ Run in a fresh interpreter. Load and parse the page up to stage,
+    return peak RSS growth and peak of Python allocations of the stage.
+    RSS covers lxml trees, which are allocated outside of Python heap """
+    os.environ.update(env)
+    logging.disable(logging.WARNING)
+    from lxml import html
+    from collector import Collector
+    collector = Collector()
+    page, tree, auto_status, families = None, None, None, None
+    if stage != 'load':
+        page = collector.load_page()
+    gc.collect()
+    reset_peak_rss()
+    rss = memory_status('VmRSS')
+    tracemalloc.start()
+    if stage == 'load':
+        page = collector.load_page()
+    elif stage == 'parse' and page.tree is None and page.html is not None:
+        tree = html.fromstring(page.html)
+    elif stage == 'parse':
+        auto_status = collector.parse_auto(page.auto or '')
+    else:
+        families = list(collector.collect_page(page, 0))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak_rss = memory_status('VmHWM')
+    #  Results were kept alive until the peak was read
+    del page, tree, auto_status, families
+    return {
+        'python_peak_mb': round(peak / 2.0**20, 3),
+        'rss_peak_mb': round(max(peak_rss - rss, 0) / 1024.0, 3),
+    }
+
+
+def stage_durations(families):
+    """ Return stage -> seconds from the exporter's own timing metrics """
+    durations = {}
+    for family in families:
+        for sample in family.samples:
+            labels, value = sample[1], sample[2]
+            if family.name == 'apache_operation_duration_seconds':
+                stage = labels['operation'].replace('_page', '')
+                durations[stage] = durations.get(stage, 0) + value
+            elif family.name == 'apache_latest_scrape_duration_seconds':
+                for stage, metrics in STAGE_METRICS.items():
+                    if labels['metric_name'] in metrics:
+                        durations[stage] = durations.get(stage, 0) + value
+    return durations
+
+
+def bench_collect(collector, iterations):
+    """ Drive Collector.collect directly """
+    latencies, stages = [], {}
+    start = time.perf_counter()
+    for _ in range(iterations):
+        scrape_start = time.perf_counter()
+        families = list(collector.collect())
+        latencies.append(time.perf_counter() - scrape_start)
+        for stage, value in stage_durations(families).items():
+            stages.setdefault(stage, []).append(value)
+    result = summary(latencies, time.perf_counter() - start)
+    #  Values skipped or stages failed on the fixture page
+    result['errors'] = sum(collector.stats.errors.values())
+    result['stages'] = dict(
+        (stage, summary(values)) for stage, values in sorted(stages.items())
+    )
+    return result
+
+
+def bench_metrics(collector, stub, iterations):
+    """ Drive /metrics over HTTP while a liveness probe polls the
+    exporter, probe latency shows how much scrapes block the IOLoop """
+    exporter = ExporterServer(collector)
+    session = requests.Session()
+    probes, done = [], threading.Event()
+
+    def probe():
+        probe_session = requests.Session()
+        while not done.is_set():
+            probe_start = time.perf_counter()
+            probe_session.get(exporter.url + '/healthz/up')
+            probes.append(time.perf_counter() - probe_start)
+            time.sleep(0.005)
+
+    try:
+        session.get(exporter.url + '/metrics').raise_for_status()
+        prober = threading.Thread(target=probe, daemon=True)
+        prober.start()
+        hits, latencies, size = stub.hits, [], 0
+        encoded = getattr(collector.stats, 'encoded_bytes', 0)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            scrape_start = time.perf_counter()
+            response = session.get(exporter.url + '/metrics')
+            latencies.append(time.perf_counter() - scrape_start)
+            response.raise_for_status()
+            size = len(response.content)
+        elapsed = time.perf_counter() - start
+        done.set()
+        prober.join()
+        result = summary(latencies, elapsed)
+        result['response_kb'] = round(size / 1024.0, 1)
+        result['fetches_per_scrape'] = round(
+            (stub.hits - hits) / float(iterations), 2
+        )
+        #  Bytes of the exposition encoded anew, the rest was reused
+        result['encoded_kb_per_scrape'] = round(
+            (getattr(collector.stats, 'encoded_bytes', 0) - encoded)
+            / 1024.0 / iterations, 1
+        )
+        probe_summary = summary(probes)
+        result['probe_p50_ms'] = probe_summary['p50_ms']
+        result['probe_p99_ms'] = probe_summary['p99_ms']
+        return result
+    finally:
+        done.set()
+        exporter.stop()
+
+
+def bench_memory(env):
+    """ Memory of load, parse and collect_page stages, every stage is
+    measured in its own process so that freed memory of previous runs
+    does not hide allocations """
+    context = multiprocessing.get_context('spawn')
+    result = {}
+    for stage in ('load', 'parse', 'collect'):
+        pool = context.Pool(1)
+        try:
+            result[stage] = pool.apply(measure_stage, (stage, env))
+        finally:
+            pool.terminate()
+    return result
+
+
+def run_scenario(name, html_body, auto_body, clusters, args):
+    stub = StubApache(html_body, auto_body, args.delay)
+    env = {
+        'APACHE_EXPORTER_URL': stub.url,
+        'APACHE_EXPORTER_NAME': name,
+        'APACHE_EXPORTER_CLUSTERS': json.dumps(clusters),
+        'APACHE_URL_SUBSTRACT_RULES': json.dumps(SUBSTRACT_RULES),
+        'APACHE_ENDPOINT_STATISTICS': 'true',
+        'APACHE_EXPORTER_PARSER': args.parser,
+        'APACHE_EXPORTER_ASYNC': 'true' if args.async_mode else 'false',
+    }
+    if args.modules:
+        env['APACHE_EXPORTER_MODULES'] = json.dumps(args.modules.split(','))
+    saved = dict((key, os.environ.get(key)) for key in env)
+    os.environ.update(env)
+    try:
+        from collector import Collector
+        collector = Collector()
+        logging.disable(logging.WARNING)
+        result = {
+            'page_kb': round(len(html_body) / 1024.0, 1),
+            'collect': bench_collect(collector, args.iterations),
+            'metrics': bench_metrics(Collector(), stub, args.iterations),
+            'memory': bench_memory(env),
+        }
+        return result
+    finally:
+        logging.disable(logging.NOTSET)
+        stub.stop()
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def load_scenarios(args):
+    """ Yield (name, html, auto, clusters) """
+    if args.html:
+        with open(args.html, 'rb') as f:
+            html_body = f.read()
+        auto_body = None
+        if args.auto:
+            with open(args.auto, 'rb') as f:
+                auto_body = f.read()
+        clusters = json.loads(args.clusters) if args.clusters else {}
+        yield os.path.basename(args.html), html_body, auto_body, clusters
+        return
+    for name in args.scenario or sorted(fixtures.SCENARIOS):
+        scenario = fixtures.SCENARIOS[name]
+        yield (name,
+               fixtures.status_page(*scenario),
+               fixtures.auto_page(*scenario),
+               fixtures.cluster_xpaths(scenario[2]))
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def flatten(tree, prefix=''):
+    """ Return {"scenario.section.value": number} """
+    result = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            result.update(flatten(value, prefix + key + '.'))
+        else:
+            result[prefix + key] = value
+    return result
+
+
+def compare(report, baseline, threshold, min_delta):
+    """ Print relative changes against baseline, return regressions.
+    Changes smaller than min_delta in absolute units are noise """
+    current = flatten(report['scenarios'])
+    previous = flatten(baseline['scenarios'])
+    regressions = []
+    print('\nCompared with %s (%s)' % (baseline.get('commit'),
+                                       baseline.get('parser')))
+    for key in sorted(current):
+        before, after = previous.get(key), current[key]
+        if not before or after is None:
+            continue
+        change = (after - before) / float(before) * 100
+        if key.rsplit('.', 1)[-1] in HIGHER_IS_BETTER:
+            change = -change
+        mark = ''
+        if change > threshold and abs(after - before) >= min_delta:
+            mark = '  REGRESSION'
+            regressions.append(key)
+        print('%-58s %10s -> %-10s %+7.1f%%%s' % (
+            key, before, after,
+            (after - before) / float(before) * 100, mark))
+    return regressions
+
+
+def slow_probes(report, limit):
+    """ Print scenarios whose liveness probe p99 during /metrics scrapes
+    is above limit milliseconds, return their names """
+    slow = []
+    for name, result in sorted(report['scenarios'].items()):
+        p99 = result['metrics']['probe_p99_ms']
+        if p99 > limit:
+            print('%s: probe_p99_ms=%s is above %s' % (name, p99, limit))
+            slow.append(name)
+    return slow
+
+
+def print_report(report):
+    print('commit %s, parser %s, %s, modules %s, %d iterations' % (
+        report['commit'], report['parser'],
+        'async' if report.get('async') else 'sync',
+        report.get('modules') or 'all', report['iterations']))
+    for name, result in report['scenarios'].items():
+        print('\n%s (%s kB page)' % (name, result['page_kb']))
+        for section in ('collect', 'metrics'):
+            values = dict(result[section])
+            stages = values.pop('stages', {})
+            print('  %-10s %s' % (section, ' '.join(
+                '%s=%s' % item for item in sorted(values.items()))))
+            for stage, stage_values in stages.items():
+                print('    %-10s %s' % (stage, ' '.join(
+                    '%s=%s' % item for item in sorted(stage_values.items()))))
+        for stage, values in result['memory'].items():
+            print('  memory %-8s python_peak_mb=%s rss_peak_mb=%s' % (
+                stage, values['python_peak_mb'], values['rss_peak_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(fixtures.SCENARIOS))
+    parser.add_argument('--parser', default='html',
+                        choices=['html', 'auto', 'stream'])
+    parser.add_argument('--modules',
+                        help='APACHE_EXPORTER_MODULES, comma separated')
+    parser.add_argument('--delay', type=float, default=0,
+                        help='stub response delay in seconds')
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='APACHE_EXPORTER_ASYNC=true')
+    parser.add_argument('--probe-p99-ms', type=float,
+                        help='fail when liveness probe p99 during /metrics '
+                             'scrapes is above it')
+    parser.add_argument('--html', help='captured /server-status page')
+    parser.add_argument('--auto', help='captured /server-status?auto')
+    parser.add_argument('--clusters', help='APACHE_EXPORTER_CLUSTERS JSON')
+    parser.add_argument('--json', help='write the report to a file')
+    parser.add_argument('--compare', help='report of a previous run')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='regression threshold in percent')
+    parser.add_argument('--min-delta', type=float, default=0.5,
+                        help='ignore smaller absolute changes (ms, MB)')
+    args = parser.parse_args()
+
+    report = {
+        'commit': commit(),
+        'python': sys.version.split()[0],
+        'parser': args.parser,
+        'async': args.async_mode,
+        'modules': args.modules,
+        'iterations': args.iterations,
+        'scenarios': {},
+    }
+    for name, html_body, auto_body, clusters in load_scenarios(args):
+        report['scenarios'][name] = run_scenario(name, html_body, auto_body,
+                                                 clusters, args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    failed = False
+    if args.probe_p99_ms is not None:
+        print()
+        failed = bool(slow_probes(report, args.probe_p99_ms))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold, args.min_delta):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
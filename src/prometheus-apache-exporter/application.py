@@ -1,18 +1,80 @@
+import os
+import signal
+import logging
 import tornado.web
 import tornado.ioloop
 from collector import Collector, MetricHandler
 from healthz import LivenessProbeHandler, ReadinessProbeHandler
-from prometheus_client.core import REGISTRY
-
-REGISTRY.register(Collector())
+from config import load_config, ConfigWatcher
 
 if __name__ == '__main__':
-    exporter = Collector()
+    logging.basicConfig(level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger('Application')
+
+    #  Settings are loaded and validated once, collectors get the result
+    config, errors = load_config()
+    for error in errors:
+        logger.warning(error)
+
+    #  Scrape several Apache instances listed in a JSON file.
+    #  Modules of other modes are imported only when they are used
+    if config.targets and config.processes > 1:
+        #  Targets are parsed in worker processes
+        from targets import ProbeHandler
+        from shards import ShardedTargetCollector
+        exporter = ShardedTargetCollector(config.targets, config)
+        handlers = [(r"/probe", ProbeHandler, {"ref_object": exporter})]
+    elif config.targets:
+        from targets import MultiTargetCollector, ProbeHandler
+        exporter = MultiTargetCollector(config.targets, config)
+        handlers = [(r"/probe", ProbeHandler, {"ref_object": exporter})]
+    else:
+        #  The only collector, /metrics and readiness use it
+        exporter = Collector(config=config)
+        handlers = []
+
+    #  cProfile over the next N scrapes at /debug/profile?scrapes=N
+    if config.profiling:
+        from profiling import ProfileHandler
+        handlers.append((r"/debug/profile", ProfileHandler))
 
     application = tornado.web.Application([
                     (r"/healthz/up", LivenessProbeHandler),
                     (r"/healthz/ready", ReadinessProbeHandler, {"ref_object": exporter}),
-                    (r"/metrics", MetricHandler, {"ref_object": exporter})])
+                    (r"/metrics", MetricHandler, {"ref_object": exporter})] +
+                    handlers)
+
+    server = application.listen(9345)
+    if exporter.poll_interval:
+        exporter.start_polling()
+
+    #  Reload settings on SIGHUP or when the config file is changed
+    def reload():
+        try:
+            config, _ = load_config(strict=True)
+        except ValueError as e:
+            logger.error(f'Config is not reloaded. {e}')
+            return
+        exporter.reload(config)
+
+    signal.signal(signal.SIGHUP, lambda signum, frame:
+        tornado.ioloop.IOLoop.current().add_callback_from_signal(reload))
+    if 'APACHE_EXPORTER_CONFIG' in os.environ:
+        ConfigWatcher(os.environ['APACHE_EXPORTER_CONFIG'], reload).start()
+
+    #  Stop accepting connections on SIGTERM and SIGINT, let the scrape
+    #  in flight finish and close connections to Apache
+    async def shutdown():
+        logger.info('Shutting down')
+        server.stop()
+        await exporter.close(exporter.config.timeout)
+        tornado.ioloop.IOLoop.current().stop()
+
+    def on_shutdown(signum, frame):
+        tornado.ioloop.IOLoop.current().add_callback_from_signal(shutdown)
 
-    application.listen(9345)
+    signal.signal(signal.SIGTERM, on_shutdown)
+    signal.signal(signal.SIGINT, on_shutdown)
     tornado.ioloop.IOLoop.instance().start()
+    logger.info('Stopped')
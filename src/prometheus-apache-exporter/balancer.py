@@ -0,0 +1,216 @@
+import re
+from lxml import etree
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+#  Column names of balancer member tables. mod_status uses the short
+#  ones, /balancer-manager the long ones
+COLUMN_NAMES = {
+    'host': ('HOST', 'WORKER URL'),
+    'status': ('STAT', 'STATUS'),
+    'route': ('ROUTE',),
+    'requests': ('ACC', 'ELECTED'),
+    'written': ('WR', 'TO'),
+    'read': ('RD', 'FROM'),
+}
+
+#  Positions used before columns were read from the header, for
+#  APACHE_EXPORTER_CLUSTERS XPaths which do not select the header row
+LEGACY_COLUMNS = {'host': 1, 'status': 2, 'route': 3,
+                  'requests': 7, 'written': 8, 'read': 9}
+
+BODY_CHILDREN = etree.XPath('/html/body/*')
+
+#  ProxyBalancer[0]Name, ProxyBalancer[0]Worker[1]Status in ?auto output
+AUTO_FIELD = re.compile(r'^ProxyBalancer\[(\d+)\](?:Worker\[(\d+)\])?(\w+)$')
+
+BalancerMember = namedtuple('BalancerMember', [
+    'cluster', 'host', 'route', 'ok', 'disabled', 'error', 'unknown',
+    'requests', 'written', 'read'
+])
+
+
+def cell_text(cell):
+    if cell.text is not None and len(cell) == 0:
+        return cell.text.strip()
+    return ''.join(cell.itertext()).strip()
+
+
+def cluster_name(heading):
+    """ Return cluster name of a "... balancer://name ..." heading """
+    pos = heading.find('balancer://')
+    if pos < 0:
+        return None
+    return heading[pos + len('balancer://'):].split()[0]
+
+
+def member_host(value):
+    """ Worker URL of /balancer-manager and ?auto is reduced to host """
+    if '://' in value:
+        return urlsplit(value).hostname or value
+    return value
+
+
+class BalancerExtractor(object):
+    """ Reads balancer members from status page tables, balancer-manager
+    page or ?auto fields.
+    Column positions are found from the header row and cached per
+    header layout. Members are cached by their raw rows, so unchanged
+    members are not parsed again.
+    A member with invalid values is skipped, errors of the latest call
+    are kept in errors """
+    def __init__(self, to_bytes):
+        self.to_bytes = to_bytes
+        self.errors = []
+        #  header cell names -> {field: position}
+        self.layouts = {}
+        #  (cluster, raw row) -> BalancerMember of the previous scrape
+        self.members = {}
+
+
+    def columns(self, header):
+        """ Return {field: position} for the header row or None if it is
+        not a balancer member header """
+        names = tuple(cell_text(cell).upper() for cell in header)
+        columns = self.layouts.get(names)
+        if columns is None and names not in self.layouts:
+            columns = {}
+            for field, aliases in COLUMN_NAMES.items():
+                for pos, name in enumerate(names):
+                    if name in aliases:
+                        columns[field] = pos
+                        break
+            if 'host' not in columns or 'status' not in columns:
+                columns = None
+            self.layouts[names] = columns
+            #  Members cached with another layout are parsed again
+            self.members = {}
+        return columns
+
+
+    def member(self, cluster, host, route, status, requests, written, read):
+        """ Return BalancerMember, raises ValueError on invalid values """
+        ok, disabled, error, unknown = 0, 0, 0, 0
+        if status.find('Ok') >= 0:
+            ok = 1
+        elif status.find('Dis') >= 0:
+            disabled = 1
+        elif status.find('Err') >= 0:
+            error = 1
+        else:
+            unknown = 1
+        return BalancerMember(
+            cluster, host, route, ok, disabled, error, unknown,
+            int(requests or 0), int(self.to_bytes(written or '0')),
+            int(self.to_bytes(read or '0'))
+        )
+
+
+    def invalid(self, cluster, error):
+        self.errors.append(f'Invalid member of cluster {cluster}. {error}')
+
+
+    def table_members(self, seen, cluster, rows, columns):
+        """ Members of table rows. A row is looked up by its serialized
+        markup, so cells of unchanged rows are not read again """
+        members = []
+        cache = self.members
+        for row in rows:
+            key = (cluster, etree.tostring(row))
+            member = cache.get(key)
+            if member is None:
+                values = {}
+                for field, pos in columns.items():
+                    values[field] = cell_text(row[pos]) \
+                        if pos < len(row) else ''
+                try:
+                    member = self.member(
+                        cluster, member_host(values['host']),
+                        values.get('route', ''), values['status'],
+                        values.get('requests'), values.get('written'),
+                        values.get('read')
+                    )
+                except ValueError as e:
+                    self.invalid(cluster, e)
+                    continue
+            seen[key] = member
+            members.append(member)
+        return members
+
+
+    def from_xpaths(self, root, clusters):
+        """ Members of clusters selected by APACHE_EXPORTER_CLUSTERS """
+        members, seen = [], {}
+        self.errors = []
+        for cluster, _, cluster_rows in clusters:
+            rows = cluster_rows(root)
+            if not rows:
+                continue
+            columns = self.columns(rows[0]) or LEGACY_COLUMNS
+            members.extend(
+                self.table_members(seen, cluster, rows[1:], columns)
+            )
+        #  Members which were not seen are forgotten
+        self.members = seen
+        return members
+
+
+    def from_tree(self, root):
+        """ Members of every cluster found on a status or balancer-manager
+        page. A "balancer://name" heading is followed by its members
+        table """
+        members, seen = [], {}
+        self.errors = []
+        cluster = None
+        for elem in BODY_CHILDREN(root):
+            if elem.tag in ('h1', 'h2', 'h3'):
+                cluster = cluster_name(''.join(elem.itertext()))
+            elif elem.tag == 'table' and cluster is not None and len(elem):
+                columns = self.columns(elem[0])
+                if columns is not None:
+                    members.extend(
+                        self.table_members(seen, cluster, elem[1:], columns)
+                    )
+                    cluster = None
+        self.members = seen
+        return members
+
+
+    def from_auto(self, auto_status):
+        """ Members from ProxyBalancer fields of ?auto output """
+        names, workers = {}, {}
+        for key, value in auto_status.items():
+            if not key.startswith('ProxyBalancer['):
+                continue
+            match = AUTO_FIELD.match(key)
+            if match is None:
+                continue
+            balancer, worker, field = match.groups()
+            balancer = int(balancer)
+            if worker is None:
+                if field == 'Name':
+                    names[balancer] = cluster_name(value) or value
+            else:
+                workers.setdefault((balancer, int(worker)), {})[field] = value
+
+        members, seen = [], {}
+        self.errors = []
+        for (balancer, _), fields in sorted(workers.items()):
+            if balancer not in names or 'Name' not in fields:
+                continue
+            raw = (fields['Name'], fields.get('Route', ''),
+                   fields.get('Status', ''), fields.get('Elected'),
+                   fields.get('Sent'), fields.get('Rcvd'))
+            key = (names[balancer], raw)
+            member = self.members.get(key)
+            if member is None:
+                try:
+                    member = self.member(names[balancer],
+                                         member_host(raw[0]), *raw[1:])
+                except ValueError as e:
+                    self.invalid(names[balancer], e)
+                    continue
+            seen[key] = member
+            members.append(member)
+        self.members = seen
+        return members
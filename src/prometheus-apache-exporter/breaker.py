@@ -0,0 +1,106 @@
+import time
+import random
+import threading
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+#  Backoff is multiplied by a random factor of 1 +- JITTER, so targets
+#  which failed together are not retried at the same moment
+JITTER = 0.2
+
+
+class CircuitBreaker(object):
+    """ Health of one Apache target.
+    Closed - requests are sent. After `failures` failed requests in a row
+    the breaker opens and requests fail fast for the backoff time. Then
+    it is half-open: one request is let through, success closes the
+    breaker, failure opens it again for twice as long, up to
+    max_backoff seconds """
+    def __init__(self, failures=3, backoff=5.0, max_backoff=300.0,
+                 logger=None):
+        self.threshold = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        #  Failed requests in a row and openings since the last success
+        self.failures = 0
+        self.trips = 0
+        self.retry_at = 0.0
+        self.trips_total = 0
+        self.rejected_total = 0
+
+
+    def allow(self):
+        """ Return True if a request may be sent to the target now """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.retry_at:
+                self.state = HALF_OPEN
+                return True
+            self.rejected_total += 1
+            return False
+
+
+    def success(self):
+        with self.lock:
+            if self.state != CLOSED and self.logger is not None:
+                self.logger.info('Apache is available again')
+            self.state = CLOSED
+            self.failures = 0
+            self.trips = 0
+
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state != HALF_OPEN and self.failures < self.threshold:
+                return
+            delay = min(self.backoff * 2 ** min(self.trips, 32),
+                        self.max_backoff)
+            delay *= random.uniform(1 - JITTER, 1 + JITTER)
+            self.state = OPEN
+            self.retry_at = time.monotonic() + delay
+            self.trips += 1
+            self.trips_total += 1
+        if self.logger is not None:
+            self.logger.warning(f'Apache is not available, next attempt '
+                                f'in {delay:.1f}s')
+
+
+    def available(self):
+        """ Return True unless requests to the target are failing """
+        return self.state == CLOSED
+
+
+    def collect(self, exporter_name):
+        """ Yield breaker state families """
+        state = GaugeMetricFamily(
+            'apache_exporter_breaker_state',
+            'Circuit breaker state of the target, 1 for the current one',
+            labels=['state', 'exporter_name']
+        )
+        trips = CounterMetricFamily(
+            'apache_exporter_breaker_trips_total',
+            'Times requests to the target failed and the breaker opened',
+            labels=['exporter_name']
+        )
+        rejected = CounterMetricFamily(
+            'apache_exporter_breaker_rejected_total',
+            'Scrapes failed fast without a request while the breaker '
+            'was open',
+            labels=['exporter_name']
+        )
+        with self.lock:
+            for name in STATES:
+                state.add_metric([name, exporter_name],
+                                 1 if name == self.state else 0)
+            trips.add_metric([exporter_name], self.trips_total)
+            rejected.add_metric([exporter_name], self.rejected_total)
+        yield state
+        yield trips
+        yield rejected
@@ -1,174 +1,640 @@
-import os
 import re
 import time
-import json
+from collections import namedtuple
+import asyncio
 import logging
-import requests
 import tornado.web
-from lxml import html
+from lxml import html, etree
+from session import PooledSession
+from breaker import CircuitBreaker
+from streamparser import StreamingParser
+from endpoints import EndpointStats
+from urlrules import UrlNormalizer
+from profiling import ExporterStats, PROFILER
+from balancer import BalancerExtractor
+from sizes import parse_size
+from exposition import ExpositionCache, Exposition, gzip_accepted
+from config import load_config, RESTART_FIELDS, MODULES
+from tornado.ioloop import IOLoop, PeriodicCallback
 
-from prometheus_client import generate_latest
-from prometheus_client.core import (REGISTRY, GaugeMetricFamily,
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.core import (CollectorRegistry, GaugeMetricFamily,
     CounterMetricFamily, HistogramMetricFamily)
 
-class MetricHandler(tornado.web.RequestHandler):
+#  mod_status scoreboard symbols
+SCOREBOARD_STATUSES = (
+    ('.', 'Open slot'),
+    ('_', 'Waiting for Connection'),
+    ('S', 'Starting up'),
+    ('R', 'Reading Request'),
+    ('W', 'Sending Reply'),
+    ('K', 'Keepalive'),
+    ('D', 'DNS Lookup'),
+    ('C', 'Closing connection'),
+    ('L', 'Logging'),
+    ('G', 'Gracefully finishing'),
+    ('I', 'Idle cleanup of worker'),
+)
+
+#  Worker modes of rows with a finished request. Rows of other modes
+#  show a request which is still running and has no duration yet
+FINISHED_MODES = frozenset('_KLGI')
+
+#  Static status page XPaths and patterns, compiled once
+STATUS_DT = etree.XPath('/html/body/dl[2]/dt')
+SCOREBOARD_PRE = etree.XPath('/html/body/pre')
+WORKER_ROWS = etree.XPath('/html/body/table[1]/tr')
+TOTALS_RE = re.compile(
+    'Total accesses: (.*?) - Total Traffic: (.*?)(?: - |$)'
+)
+UPTIME_RE = re.compile(r'(\d+) (day|hour|minute|second)')
+UPTIME_UNITS = {'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}
+RATES_RE = re.compile('(.*) requests/sec - (.*?)/second - (.*?)/request')
+
+#  Extractor modules by prefixes of metric families they produce
+MODULE_FAMILIES = {
+    'totals': ('apache_accesses', 'apache_traffic_bytes',
+               'apache_requests_per_second', 'apache_io_bytes',
+               'apache_uptime_seconds'),
+    'scoreboard': ('apache_scoreboard_current',),
+    'workers': ('apache_scoreboard_process_current',),
+    'balancer': ('apache_balancer_',),
+    'endpoints': ('apache_endpoint_response_time_seconds',),
+}
+#  Modules read from the scoreboard and the status summary
+STATUS_MODULES = frozenset(('totals', 'scoreboard', 'workers'))
+
+#  Exposition of one scrape, shared between requests
+CachedScrape = namedtuple('CachedScrape', ['exposition', 'timestamp'])
+
+#  Loaded /server-status page: HTML and/or machine-readable ?auto text,
+#  tree is set instead of html when the page was parsed while streaming,
+#  balancer is /balancer-manager HTML when it is configured
+StatusPage = namedtuple('StatusPage', ['html', 'auto', 'tree', 'balancer'])
+
+
+class ExpositionHandler(tornado.web.RequestHandler):
+    """ Base of /metrics handlers. Writes Exposition in the format and
+    encoding the client accepts, name[] arguments select families.
+    Requests in flight are counted, shutdown waits for them """
+    def initialize(self, ref_object):
+        self.obj = ref_object
+
+    def prepare(self):
+        self.obj.requests += 1
+
+    def on_finish(self):
+        self.obj.requests -= 1
+        self.obj = None
+
+    async def write_exposition(self, exposition, extra=(), executor=True):
+        _, content_type = choose_encoder(self.request.headers.get('Accept'))
+        openmetrics = content_type.startswith('application/openmetrics-text')
+        compress = gzip_accepted(self.request.headers.get('Accept-Encoding'))
+        args = (exposition.body, openmetrics, compress,
+                self.get_arguments('name[]'), extra)
+        if executor:
+            body = await IOLoop.current().run_in_executor(None, PROFILER.run,
+                                                          *args)
+        else:
+            body = PROFILER.run(*args)
+        self.set_header('Content-Type', content_type)
+        self.set_header('Vary', 'Accept, Accept-Encoding')
+        if compress:
+            self.set_header('Content-Encoding', 'gzip')
+        self.write(body)
+
+
+    def selected_modules(self, scrape_cache):
+        """ Return modules selected by module and name[] arguments """
+        modules = self.get_arguments('module')
+        unknown = set(modules).difference(MODULES)
+        if unknown:
+            raise tornado.web.HTTPError(400, 'Unknown module %s',
+                                        ', '.join(sorted(unknown)))
+        return scrape_cache.select_modules(modules,
+                                           self.get_arguments('name[]'))
+
+
+class MetricHandler(ExpositionHandler):
     """ Tornado Handler for /metrics endpoint """
     def __init__(self, application, request, **kwargs):
         super().__init__(application, request, **kwargs)
         self.logger = logging.getLogger(type(self).__name__)
         self.logger.setLevel(logging.DEBUG)
 
-    def initialize(self, ref_object):
-        self.obj = ref_object
+    async def get(self):
+        start = time.perf_counter()
+        modules = self.selected_modules(self.obj)
+        if self.obj.poll_interval:
+            cached = await self.obj.get_cached_scrape()
+            age = time.monotonic() - cached.timestamp
+            self.set_header('Age', int(age))
+            await self.write_exposition(cached.exposition,
+                                        [self.obj.snapshot_age(age)])
+        elif modules != self.obj.modules:
+            await self.write_exposition(
+                await self.obj.scrape_modules(modules)
+            )
+        elif self.obj.async_mode:
+            await self.write_exposition(
+                await self.obj.generate_latest_scrape_async()
+            )
+        else:
+            await self.write_exposition(self.obj.generate_latest_scrape(),
+                                        executor=False)
+        end = time.perf_counter()
+        self.logger.info("Scraped in %.2gs" % (end-start))
 
-    def get(self):
-        start = time.clock()
-        self.obj.collect()
-        value = self.obj.generate_latest_scrape()
-        self.write(value)
-        end = time.clock()
-        self.logger.info("Scraped in %.2gs" % (end-start))        
 
-    def on_finish(self):
-        self.obj = None
+class PageSnapshot(object):
+    """ Already fetched status page, exposed as a collector so that
+    it is rendered without another request to Apache """
+    def __init__(self, collector, page, load_duration, modules=None):
+        self.collector = collector
+        self.page = page
+        self.load_duration = load_duration
+        self.modules = modules
+
+    def collect(self):
+        return self.collector.collect_page(self.page, self.load_duration,
+                                           self.modules)
+
+
+class ScrapeCache(object):
+    """ Keeps the latest encoded scrape and coalesces concurrent
+    refreshes. Subclasses implement scrape() """
+    def __init__(self):
+        self.cached_scrape = None
+        self.refresh_future = None
+        self.poller = None
+        #  /metrics requests in flight
+        self.requests = 0
+        #  Text format and OpenMetrics encoders by openmetrics flag,
+        #  they keep encodings of the previous scrape
+        self.encoders = {False: ExpositionCache(),
+                         True: ExpositionCache(openmetrics=True)}
+
+
+    async def scrape(self, modules=None):
+        """ Return Exposition of a fresh scrape of the modules,
+        all enabled modules by default """
+        raise NotImplementedError
+
+
+    async def scrape_modules(self, modules):
+        """ Scrape only the modules, the result is not cached """
+        try:
+            return await self.scrape(modules)
+        finally:
+            PROFILER.scrape_done()
+
+
+    def select_modules(self, modules=(), names=()):
+        """ Return enabled modules which are requested and produce
+        families of the metric names, when they are given """
+        selected = self.modules
+        if modules:
+            selected = selected.intersection(modules)
+        if names:
+            selected = selected.intersection(
+                module for module, prefixes in MODULE_FAMILIES.items()
+                if any(name.startswith(prefixes) for name in names)
+            )
+        return selected
+
+
+    def exposition(self, families):
+        return Exposition(families, self.encoders)
 
 
-class Collector(object):
+    def collect_exposition(self, source):
+        """ Return Exposition of families collected from source """
+        return self.exposition(list(source.collect()))
+
+
+    async def generate_latest_scrape_async(self):
+        """ Scrape without blocking the IOLoop """
+        cached = await self.refresh()
+        return cached.exposition
+
+
+    def refresh(self):
+        """ Start a new scrape unless one is already in flight.
+        Concurrent callers share the same future """
+        if self.refresh_future is None:
+            self.refresh_future = asyncio.ensure_future(self._refresh())
+        return self.refresh_future
+
+
+    async def _refresh(self):
+        try:
+            exposition = await self.scrape()
+            self.cached_scrape = CachedScrape(exposition, time.monotonic())
+            return self.cached_scrape
+        finally:
+            PROFILER.scrape_done()
+            self.refresh_future = None
+
+
+    async def get_cached_scrape(self):
+        """ Return the latest polled scrape, waiting for the first one """
+        if self.cached_scrape is None:
+            return await self.refresh()
+        return self.cached_scrape
+
+
+    def start_polling(self):
+        """ Refresh the cached scrape every poll_interval seconds """
+        def poll():
+            IOLoop.current().spawn_callback(self.poll)
+        poll()
+        self.poller = PeriodicCallback(poll, self.poll_interval * 1000)
+        self.poller.start()
+
+
+    async def poll(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            self.logger.error(f'Background scrape failed. Exception: {e}')
+
+
+    async def close(self, timeout=10):
+        """ Stop polling and wait up to timeout seconds for the scrape
+        and requests in flight, so that shutdown does not cut them off """
+        if self.poller is not None:
+            self.poller.stop()
+        deadline = time.monotonic() + timeout
+        while self.requests or self.refresh_future is not None:
+            if time.monotonic() > deadline:
+                self.logger.warning(f'{self.requests} requests are '
+                                    f'not finished')
+                break
+            await asyncio.sleep(0.05)
+
+
+    def snapshot_age(self, age):
+        """ Return the age of the cached scrape """
+        snapshot_age = GaugeMetricFamily(
+            'apache_exporter_snapshot_age_seconds',
+            'Seconds since the served metrics were scraped from Apache',
+            labels=['exporter_name']
+        )
+        snapshot_age.add_metric([self.name], age)
+        return snapshot_age
+
+
+class Collector(ScrapeCache):
     """ Apache exporter. 
     Provides information about current workers, status of 
     requests balancing within preconfigured clusters"""
-    def __init__(self):
+    def __init__(self, url=None, name=None, timeout=None, config=None):
+        """ url, name and timeout override settings of config, which is
+        loaded from environment when not given """
+        super().__init__()
         logging.basicConfig(level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(type(self).__name__)
 
-        try:
-            self.url = os.environ['APACHE_EXPORTER_URL']
-        except Exception as e:
-            self.logger.error(f'Variable APACHE_EXPORTER_URL is not set. {e}')
+        self.overrides = dict(
+            (key, value) for key, value in
+            (('url', url), ('name', name), ('timeout', timeout))
+            if value is not None
+        )
+        if config is None:
+            config, errors = load_config()
+            for error in errors:
+                self.logger.warning(error)
+        config = config._replace(**self.overrides)
+        if not config.url:
+            self.logger.error('Variable APACHE_EXPORTER_URL is not set')
             raise SystemExit
+        if config.endpoint_stats and config.url_substract_rules is None:
+            self.logger.warning('APACHE_URL_SUBSTRACT_RULES is not set, '
+                                'endpoint statistics are disabled')
 
-        try:           
-            self.url_substract_rules = json.loads(
-                os.environ['APACHE_URL_SUBSTRACT_RULES']
-            )
-        except Exception as e:
-            self.logger.warn(
-                f'Could not get APACHE_URL_SUBSTRACT_RULES. {e}'
-            )
-            self.logger.warn(
-                'APACHE_URL_SUBSTRACT_RULES value: {}'.format(
-                    self.url_substract_rules
-                )
+        self.config = None
+        #  Stage timings, page bytes, rows and errors across scrapes
+        self.stats = ExporterStats()
+        self.balancer = BalancerExtractor(parse_size)
+        #  stage -> (inputs, families) of the previous scrape, families
+        #  are reused as is while their inputs are the same
+        self.families = {}
+        #  Apache uptime of the previous scrape, to detect restarts
+        self.uptime = None
+        self.configure(config)
+        #  Registry of this collector only, without process and platform
+        #  collectors of the global one. Collector has no describe, it
+        #  is not scraped on registration
+        self.registry = CollectorRegistry()
+        self.registry.register(self)
+
+
+    def configure(self, config):
+        """ Apply settings. Objects which depend on changed settings are
+        rebuilt, the rest keep their state """
+        previous = self.config
+
+        def changed(*fields):
+            return previous is None or any(
+                getattr(previous, f) != getattr(config, f) for f in fields
             )
 
-        #  Collect additional statistics about requests
-        try:
-            self.endpoint_stats = os.environ['APACHE_ENDPOINT_STATISTICS']
-            if self.endpoint_stats.lower() == "true":
-                self.endpoint_stats = True
-            else:
-                self.endpoint_stats = False
-        except Exception as e:
-            self.endpoint_stats = False
+        if changed('url_substract_rules', 'url_templates',
+                   'url_regex_rules', 'url_cache_size'):
+            self.url_normalizer = UrlNormalizer(config.url_substract_rules,
+                                                config.url_templates,
+                                                config.url_regex_rules,
+                                                config.url_cache_size)
 
-        self.url_count = {}
-        self.url_sum = {}      
+        #  Histogram history is kept unless buckets are changed
+        if changed('endpoint_buckets', 'endpoint_max_series'):
+            self.endpoints = EndpointStats(config.endpoint_buckets,
+                                           config.endpoint_max_series)
+
+        #  Keep-alive connections kept open to Apache
+        if changed('pool_size', 'timeout', 'connect_timeout'):
+            session = getattr(self, 'session', None)
+            self.session = PooledSession(config.pool_size, config.timeout,
+                                         config.connect_timeout, session)
+            if session is not None:
+                session.close()
+
+        #  Failed requests open the breaker, scrapes then fail fast with
+        #  apache_up 0 until the backoff time is over
+        if changed('breaker_failures', 'breaker_backoff',
+                   'breaker_max_backoff'):
+            self.breaker = CircuitBreaker(config.breaker_failures,
+                                          config.breaker_backoff,
+                                          config.breaker_max_backoff,
+                                          self.logger)
+
+        #  "auto" reads totals and scoreboard from machine-readable
+        #  ?auto output, HTML is loaded only for balancer and endpoints.
+        #  "stream" parses HTML while it is downloaded and keeps only
+        #  elements metrics are read from
+        if config.parser == 'auto':
+            self.auto_url = config.url \
+                + ('&' if '?' in config.url else '?') + 'auto'
+        else:
+            self.auto_url = None
+        self.stream_tables = StreamingParser.table_indexes(
+            cluster.xpath for cluster in config.clusters
+        )
+
+        #  Balancer members are read from /balancer-manager, tables of
+        #  APACHE_EXPORTER_CLUSTERS or clusters found on the status page
+        if config.balancer_manager_url:
+            self.balancer_source = 'manager'
+        elif config.clusters:
+            self.balancer_source = 'xpaths'
+        elif config.balancer_discovery:
+            self.balancer_source = 'discovery'
+        else:
+            self.balancer_source = None
+
+        #  Modules which are enabled and have their settings, the others
+        #  are not run and page data only they read is not loaded
+        modules = set(config.modules)
+        if not config.scoreboard_thread_limit:
+            modules.discard('workers')
+        if not config.endpoint_stats or config.url_substract_rules is None:
+            modules.discard('endpoints')
+        if self.balancer_source is None:
+            modules.discard('balancer')
+        self.modules = frozenset(modules)
+
+        self.url = config.url
+        self.name = config.name
+        if previous is None:
+            self.async_mode = config.async_mode
+            self.poll_interval = config.poll_interval
+        self.config = config
+
+
+    def reload(self, config=None):
+        """ Apply settings of the base config, loaded from environment
+        and APACHE_EXPORTER_CONFIG file when not given. Invalid settings
+        are rejected and the current ones are kept """
+        if config is None:
+            try:
+                config, _ = load_config(strict=True)
+            except ValueError as e:
+                self.logger.error(f'Config is not reloaded. {e}')
+                return False
+        config = config._replace(**self.overrides)
+        for field in RESTART_FIELDS:
+            if getattr(config, field) != getattr(self.config, field):
+                self.logger.warning(f'{field} is changed, restart to apply')
+        self.configure(config)
+        self.logger.info(f'Config of {self.name} is reloaded')
+        return True
 
 
     def generate_latest_scrape(self):
-        """ Return a content of Prometheus registry """
-        return generate_latest(REGISTRY)
+        """ Return Exposition of the collector registry """
+        return self.collect_exposition(self.registry)
 
 
-    def ping(self):
-        """ Check Apache availability """
+    async def close(self, timeout=10):
+        await super().close(timeout)
+        self.session.close()
+
+
+    def exposition(self, families):
+        return Exposition(families, self.encoders, self.stats)
+
+
+    async def scrape(self, modules=None):
+        page, duration = await self.fetch(modules)
+        return await IOLoop.current().run_in_executor(
+            None, PROFILER.run, self.collect_exposition,
+            PageSnapshot(self, page, duration, modules)
+        )
+
+
+    async def fetch(self, modules=None):
+        """ Load the status page, return it and load duration """
+        with self.stats.timer('fetch') as timer:
+            page = await self.load_page_async(modules)
+        return page, timer.duration
+
+
+    def active_modules(self, modules=None):
+        """ Return enabled modules out of the given ones """
+        return self.modules if modules is None else self.modules & modules
+
+
+    def page_data(self, modules):
+        """ Return status pages the modules read: "auto" - ?auto output,
+        "html" - HTML status page, "manager" - /balancer-manager.
+        Without modules the cheapest status page is loaded, apache_up
+        is reported only after a request to Apache """
+        if not modules:
+            return {'html' if self.auto_url is None else 'auto'}
+        data = set()
+        if modules & STATUS_MODULES:
+            data.add('html' if self.auto_url is None else 'auto')
+        if 'endpoints' in modules:
+            data.add('html')
+        if 'balancer' in modules:
+            if self.balancer_source == 'manager':
+                data.add('manager')
+            elif self.balancer_source == 'xpaths' or self.auto_url is None:
+                data.add('html')
+            elif 'html' not in data:
+                #  Members are found on the HTML page when it is loaded
+                #  anyway, ?auto output is read otherwise
+                data.add('auto')
+        return data
+
+
+    def stream_parser(self, modules):
+        """ Return StreamingParser keeping only what the modules read """
+        keep = ('table',)
+        if 'totals' in modules:
+            keep += ('dl',)
+        if modules & {'scoreboard', 'workers'}:
+            keep += ('pre',)
+        balancer = self.balancer_source if 'balancer' in modules else None
+        return StreamingParser(
+            self.stream_tables if balancer == 'xpaths' else set(),
+            1 if 'endpoints' in modules else None,
+            balancer == 'discovery',
+            keep
+        )
+
+
+    def load_page(self, modules=None):
+        """ Fetch Apache status page, only parts the modules read.
+        Return None when Apache is not available or the breaker is open """
+        modules = self.active_modules(modules)
+        data = self.page_data(modules)
+        #  The breaker is asked only before requests are sent, so only
+        #  a fetched page closes a half-open breaker
+        if not data or not self.breaker.allow():
+            return None
         try:
-            ping = requests.get(self.url, verify=False)
-            if ping.status_code == requests.codes.ok:
-                return 1
-            else:
-                return 0
+            auto = None
+            if 'auto' in data:
+                auto = self.session.get(self.auto_url)
+                self.stats.add_page_bytes(len(auto))
+                auto = auto.decode('utf-8', errors='replace')
+            content, tree = None, None
+            if 'html' in data and self.config.parser == 'stream':
+                parser = self.stream_parser(modules)
+                for chunk in self.session.stream(self.url):
+                    self.stats.add_page_bytes(len(chunk))
+                    parser.feed(chunk)
+                tree = parser.close()
+            elif 'html' in data:
+                content = self.session.get(self.url)
+                self.stats.add_page_bytes(len(content))
+            balancer = None
+            if 'manager' in data:
+                balancer = self.session.get(self.config.balancer_manager_url)
+                self.stats.add_page_bytes(len(balancer))
         except Exception as e:
-            self.logger.error(f'Failed to ping Apache. Exception: {e}')
-            return 0
+            self.stats.add_error('fetch')
+            self.logger.error(f'Failed to Apache status page. Exception: {e}')
+            self.breaker.failure()
+            return None
+        self.breaker.success()
+        return StatusPage(content, auto, tree, balancer)
+
+
+    async def load_page_async(self, modules=None):
+        """ Fetch Apache status page in the executor """
+        return await IOLoop.current().run_in_executor(None, PROFILER.run,
+                                                      self.load_page, modules)
+
+
+    def ping(self):
+        """ Check Apache availability by results of the latest scrapes,
+        without a request of its own """
+        return 1 if self.breaker.available() else 0
 
 
     @staticmethod
-    def str_to_bytes(str):
-        """ Converts string to bytes """
-        str = str.upper()
-        res = 0
-
-        pos = str.find('K')
-        if pos > 0:
-            res = float(str[0:pos].strip()) * 2**10
-            return res       
-        pos = str.find('M')
-        if pos > 0:
-            res = float(str[0:pos].strip()) * 2**20
-            return res
-        pos = str.find('G')
-        if pos > 0:
-            res = float(str[0:pos].strip()) * 2**30
-            return res
-        pos = str.find('B')
-        if pos > 0:
-            res = float(str[0:pos].strip())
-            return res
-
-        return res
-
-
-    def sanitize_url(self, input_url):       
-        if input_url == 'NULL' or input_url == '..reading..' \
-            or input_url.find(" ") == -1:
-            return None, None
-        if self.url_substract_rules is None:
-            return None, None
+    def count_scoreboard(workers):
+        """ Return (status, count) for every scoreboard status """
+        result, known = [], 0
+        for symbol, status in SCOREBOARD_STATUSES:
+            count = workers.count(symbol)
+            known += count
+            result.append((status, count))
+        result.append(('Unknown', len(workers) - known))
+        return result
 
-        #  split into method and url       
-        method, tmp = input_url.split(sep=" ", maxsplit=1)                
-        
-        #  take first 5 contexts
-        url = ""
-        url_parts = tmp.strip().split(sep="/", maxsplit=6)            
-        for x in url_parts[1:5]:
-            url += "/%s" % x
-        
-        #  remove dymanic content
-        for rule in self.url_substract_rules:
-            pos = url.find(rule)            
-            if pos >= 0:
-                url = url[0:pos+len(rule)]
-
-        return method, url
-
-
-    def put_histogram_values(self, method, url, duration):
-        buckets = [0.01,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0,999999]
-        buckets.sort(reverse=True)
-
-        for b in buckets:
-            bucket_name = str(b).replace('999999','+inf')
-            if duration <= b:
-                if (method, url, bucket_name) not in self.url_count:
-                    self.url_count[method, url, bucket_name] = 1
-                else:
-                    self.url_count[method, url, bucket_name] += 1
-                if (method, url) not in self.url_sum:
-                    self.url_sum[method, url] = duration
-                else:
-                    self.url_sum[method, url] += duration
-            elif duration > b:
-                if (method, url, bucket_name) not in self.url_count:
-                    self.url_count[method, url, bucket_name] = 0
-                if (method, url) not in self.url_sum:
-                    self.url_sum[method, url] = 0
+
+    def cached_families(self, stage, inputs):
+        """ Return families of the stage built from the same inputs on
+        the previous scrape, None if inputs are changed """
+        cached = self.families.get(stage)
+        if cached is not None and cached[0] == inputs:
+            return cached[1]
+        return None
+
+
+    def update_uptime(self, uptime):
+        """ Count a counter reset when Apache uptime goes back """
+        if self.uptime is not None and uptime < self.uptime:
+            self.stats.add_counter_reset()
+            self.logger.info(f'Apache {self.name} was restarted')
+        self.uptime = uptime
+
+
+    @staticmethod
+    def parse_uptime(text):
+        """ Return seconds of "1 day 2 hours 3 minutes 4 seconds" """
+        return sum(int(count) * UPTIME_UNITS[unit]
+                   for count, unit in UPTIME_RE.findall(text))
+
+
+    @staticmethod
+    def parse_auto(text):
+        """ Parses mod_status ?auto output into a dict """
+        status = {}
+        for line in text.splitlines():
+            key, sep, value = line.partition(':')
+            if sep:
+                status[key.strip()] = value.strip()
+        return status
+
+
+    def sanitize_url(self, input_url):
+        """ Return method and endpoint of the request line """
+        if self.config.url_substract_rules is None:
+            return None, None
+        return self.url_normalizer.normalize(input_url)
 
 
     def collect(self):
-        """ Scrape /server-status url and collect metrics """      
+        """ Scrape /server-status url and collect metrics """
+        try:
+            yield from PROFILER.run(self.collect_latest)
+        finally:
+            PROFILER.scrape_done()
+
+
+    def collect_latest(self, modules=None):
+        """ Load the status page and return its metric families """
+        page, duration = self.fetch_page(modules)
+        return list(self.collect_page(page, duration, modules))
+
+
+    def fetch_page(self, modules=None):
+        """ Load the status page in the calling thread, return it and
+        load duration """
+        with self.stats.timer('fetch') as timer:
+            page = self.load_page(modules)
+        return page, timer.duration
+
+
+    def collect_page(self, page, load_duration, modules=None):
+        """ Collect metrics of the modules, all enabled by default, from
+        already loaded /server-status page """
         #  Counters
         accesses_total = CounterMetricFamily('apache_accesses_total', 
             'Total requests served count since startup',
@@ -195,6 +661,9 @@ class Collector(object):
         bytes_request = GaugeMetricFamily('apache_io_bytes_per_request', 
             'Bytes write/read  per request', 
             labels=['exporter_name'])
+        uptime = GaugeMetricFamily('apache_uptime_seconds',
+            'Seconds since Apache was started',
+            labels=['exporter_name'])
         route_ok = GaugeMetricFamily('apache_balancer_route_ok', 
             'Balancing status of the route is OK', 
             labels=['cluster', 'host', 'route', 'exporter_name'])
@@ -210,6 +679,11 @@ class Collector(object):
         scoreboard = GaugeMetricFamily('apache_scoreboard_current', 
             'Count of workers grouped by status',
             labels=['status', 'exporter_name'])
+        scoreboard_process = GaugeMetricFamily(
+            'apache_scoreboard_process_current',
+            'Count of workers of the process grouped by status',
+            labels=['process', 'status', 'exporter_name']
+        )
         latest_scrape=GaugeMetricFamily(
             'apache_latest_scrape_duration_seconds',
             'Latest scrape duration in seconds',
@@ -220,6 +694,27 @@ class Collector(object):
             'Operation duration in seconds',
             labels=['operation','exporter_name']
         )
+        http_requests = CounterMetricFamily(
+            'apache_exporter_http_requests_total',
+            'Requests sent to Apache',
+            labels=['exporter_name']
+        )
+        http_connections = CounterMetricFamily(
+            'apache_exporter_http_connections_total',
+            'Connections opened to Apache, the rest of requests reused one',
+            labels=['exporter_name']
+        )
+        http_not_modified = CounterMetricFamily(
+            'apache_exporter_http_not_modified_total',
+            'Status page responses reused after 304 Not Modified',
+            labels=['exporter_name']
+        )
+
+        up = GaugeMetricFamily(
+            'apache_up',
+            'Apache status page was loaded on the scrape',
+            labels=['exporter_name']
+        )
 
         #  Histograms
         endpoint_response_time = HistogramMetricFamily(
@@ -228,245 +723,327 @@ class Collector(object):
             labels=['method', 'endpoint', 'exporter_name']
         )
 
-        try:
-            exporter_name = os.environ['APACHE_EXPORTER_NAME']
-        except:
-            exporter_name = 'none'
+        config = self.config
+        exporter_name = config.name
+        modules = self.active_modules(modules)
 
-        start = time.clock()
-        try:
-            page = requests.get(self.url, verify=False)
-            page.raise_for_status()
-        except Exception as e:
-            self.logger.error(f'Failed to Apache status page. Exception: {e}')
-        duration = float("%.3g" % (time.clock()-start))
-        operation_duration.add_metric(['load_page',exporter_name], duration)
+        up.add_metric([exporter_name], 0 if page is None else 1)
+        operation_duration.add_metric(['load_page',exporter_name],
+                                      load_duration)
+        if page is None:
+            #  Apache is not available, nothing to extract
+            yield up
+            yield operation_duration
+            yield from self.breaker.collect(exporter_name)
+            yield from self.stats.collect(exporter_name)
+            return
+        _requests, _connections, _not_modified = self.session.stats()
+        http_requests.add_metric([exporter_name], _requests)
+        http_connections.add_metric([exporter_name], _connections)
+        http_not_modified.add_metric([exporter_name], _not_modified)
 
-        start = time.clock()
-        try:
-            root = html.fromstring(page.content)
-        except Exception as e:
-            self.logger.error(f'Failed to parse page as html. Exception: {e}')
-        duration = float("%.3g" % (time.clock()-start))
-        operation_duration.add_metric(['parse_page',exporter_name], duration)
+        with self.stats.timer('parse') as timer:
+            root, auto_status = page.tree, None
+            #  Page loaded only for apache_up is not parsed
+            if page.html is not None and modules:
+                try:
+                    root = html.fromstring(page.html)
+                except Exception as e:
+                    self.stats.add_error('parse')
+                    self.logger.error(
+                        f'Failed to parse page as html. Exception: {e}'
+                    )
+            if page.auto is not None:
+                auto_status = self.parse_auto(page.auto)
+        operation_duration.add_metric(['parse_page',exporter_name],
+                                      timer.duration)
 
         #  Total traffic and accesses and requests,bytes per second/request
-        start = time.clock()
-        for x in range(1, 20):
-            tmp_str = root.xpath("/html/body/dl[2]/dt[%d]" % x)[0].text.strip()
-            if tmp_str.find('Total accesses:') >=0:
-                match = re.match('Total accesses: (.*) - Total Traffic: (.*)', 
-                                 tmp_str)
-                _accesses_total = match.group(1)
-                _traffic_total = self.str_to_bytes(match.group(2))
-                #  Update metrics if they were found
-                if _accesses_total is not None:
-                    accesses_total.add_metric([exporter_name], _accesses_total)
-                if _traffic_total is not None:
-                    traffic_total.add_metric([exporter_name], _traffic_total)
-                break
-        duration = float("%.3g" % (time.clock()-start))
-        latest_scrape.add_metric(['apache_accesses_total',exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_traffic_bytes_total',exporter_name], 
-                                 duration)
-
-        start = time.clock()
-        for x in range(1, 20):
-            tmp_str = root.xpath("/html/body/dl[2]/dt[%d]" % x)[0].text.strip()
-            if tmp_str.find('requests') >=0 and tmp_str.find('second') >=0:
-                match=re.match(
-                    '(.*) requests/sec - (.*/second) - (.*/request)', tmp_str
-                )
-                _requests_sec = match.group(1)
-                _bytes_sec = self.str_to_bytes(match.group(2))
-                _bytes_request = self.str_to_bytes(match.group(3))
-                #  Update metrics if they were found
-                if _requests_sec is not None:
-                    requests_sec.add_metric([exporter_name], _requests_sec)
-                if _bytes_sec is not None:
-                    bytes_sec.add_metric([exporter_name], _bytes_sec)
-                if _bytes_request is not None:
-                    bytes_request.add_metric([exporter_name], _bytes_request)
-                break
-        duration = float("%.3g" % (time.clock()-start))
-        latest_scrape.add_metric(['apache_requests_per_second',exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_io_bytes_per_second',exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_io_bytes_per_request',exporter_name], 
-                                 duration)
-
-        #  Get workers statuses
-        start = time.clock()
-        workers_map = {}
-        workers = root.xpath('/html/body/pre')[0].text.strip()
-        for symbol in range (0,len(workers)):
-            if workers[symbol] in workers_map:
-                workers_map[workers[symbol]] += 1
-            else:
-                workers_map[workers[symbol]] = 1            
-        #  Update metrics 
-        for worker_status in workers_map:
-            if worker_status == ".":
-                status = "Open slot"
-            elif worker_status == "_":
-                status = "Waiting for Connection"
-            elif worker_status == "S":
-                status = "Starting up"
-            elif worker_status == "R":
-                status = "Reading Request"
-            elif worker_status == "W":
-                status = "Sending Reply"
-            elif worker_status == "K":
-                status = "Keepalive"
-            elif worker_status == "D":
-                status = "DNS Lookup"
-            elif worker_status == "C":
-                status = "Closing connection"
-            elif worker_status == "L":
-                status = "Logging"
-            elif worker_status == "G":
-                status = "Gracefully finishing"
-            elif worker_status == "I":
-                status = "Idle cleanup of worker"                                
-            else:
-                status = "Unknown"
-            if worker_status != "\n":
-                #Update workers scoreboard
-                scoreboard.add_metric([status, exporter_name], 
-                                      int(workers_map[worker_status]))
-        duration = float("%.3g" % (time.clock()-start))
-        latest_scrape.add_metric(['apache_scoreboard_current',exporter_name], 
-                                 duration)
+        if 'totals' in modules:
+            with self.stats.timer('totals') as timer:
+                _uptime = None
+                if auto_status is not None:
+                    _uptime = auto_status.get('ServerUptimeSeconds',
+                                              auto_status.get('Uptime'))
+                    if 'Total Accesses' in auto_status:
+                        accesses_total.add_metric(
+                            [exporter_name],
+                            float(auto_status['Total Accesses'])
+                        )
+                    if 'Total kBytes' in auto_status:
+                        traffic_total.add_metric(
+                            [exporter_name],
+                            float(auto_status['Total kBytes']) * 2**10
+                        )
+                elif root is not None:
+                    for dt in STATUS_DT(root):
+                        tmp_str = (dt.text or '').strip()
+                        if tmp_str.startswith('Server uptime:'):
+                            _uptime = self.parse_uptime(tmp_str)
+                        if tmp_str.find('Total accesses:') >=0:
+                            match = TOTALS_RE.match(tmp_str)
+                            _accesses_total = match.group(1)
+                            try:
+                                _traffic_total = parse_size(match.group(2))
+                            except ValueError as e:
+                                self.stats.add_error('totals')
+                                self.logger.warning(e)
+                                _traffic_total = None
+                            #  Update metrics if they were found
+                            if _accesses_total is not None:
+                                accesses_total.add_metric([exporter_name],
+                                                          _accesses_total)
+                            if _traffic_total is not None:
+                                traffic_total.add_metric([exporter_name],
+                                                         _traffic_total)
+                            break
+                if _uptime is not None:
+                    self.update_uptime(float(_uptime))
+                    uptime.add_metric([exporter_name], float(_uptime))
+            latest_scrape.add_metric(['apache_accesses_total',exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_traffic_bytes_total',exporter_name], 
+                                     timer.duration)
+
+            with self.stats.timer('rates') as timer:
+                if auto_status is not None:
+                    if 'ReqPerSec' in auto_status:
+                        requests_sec.add_metric(
+                            [exporter_name], float(auto_status['ReqPerSec'])
+                        )
+                    if 'BytesPerSec' in auto_status:
+                        bytes_sec.add_metric(
+                            [exporter_name], float(auto_status['BytesPerSec'])
+                        )
+                    if 'BytesPerReq' in auto_status:
+                        bytes_request.add_metric(
+                            [exporter_name], float(auto_status['BytesPerReq'])
+                        )
+                elif root is not None:
+                    for dt in STATUS_DT(root):
+                        tmp_str = (dt.text or '').strip()
+                        if tmp_str.find('requests') >=0 \
+                            and tmp_str.find('second') >=0:
+                            match = RATES_RE.match(tmp_str)
+                            _requests_sec = match.group(1)
+                            try:
+                                _bytes_sec = parse_size(match.group(2))
+                                _bytes_request = parse_size(match.group(3))
+                            except ValueError as e:
+                                self.stats.add_error('rates')
+                                self.logger.warning(e)
+                                _bytes_sec, _bytes_request = None, None
+                            #  Update metrics if they were found
+                            if _requests_sec is not None:
+                                requests_sec.add_metric([exporter_name],
+                                                        _requests_sec)
+                            if _bytes_sec is not None:
+                                bytes_sec.add_metric([exporter_name],
+                                                     _bytes_sec)
+                            if _bytes_request is not None:
+                                bytes_request.add_metric([exporter_name],
+                                                         _bytes_request)
+                            break
+            latest_scrape.add_metric(['apache_requests_per_second',exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_io_bytes_per_second',exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_io_bytes_per_request',exporter_name], 
+                                     timer.duration)
+
+        #  Get workers statuses, in total and by processes
+        if modules & {'scoreboard', 'workers'}:
+            with self.stats.timer('scoreboard') as timer:
+                if auto_status is not None:
+                    workers = auto_status.get('Scoreboard', '')
+                else:
+                    pre = SCOREBOARD_PRE(root) if root is not None else []
+                    workers = (pre[0].text if pre else None) or ''
+                workers = ''.join(workers.split())
+                if 'scoreboard' in modules:
+                    for status, count in self.count_scoreboard(workers):
+                        scoreboard.add_metric([status, exporter_name], count)
+                if 'workers' in modules:
+                    #  Every process has ThreadLimit slots, statuses no
+                    #  worker of the process is in are left out
+                    threads = config.scoreboard_thread_limit
+                    for process in range(0, len(workers), threads):
+                        slots = workers[process:process + threads]
+                        for status, count in self.count_scoreboard(slots):
+                            if not count:
+                                continue
+                            scoreboard_process.add_metric(
+                                [str(process // threads), status,
+                                 exporter_name],
+                                count
+                            )
+            latest_scrape.add_metric(['apache_scoreboard_current',exporter_name], 
+                                     timer.duration)
 
         #  Get balancing and routes status
-        start = time.clock()        
-        try:
-            cluster_xpaths = json.loads(os.environ['APACHE_EXPORTER_CLUSTERS'])
-        except Exception as e:
-            self.logger.error(f'Cannot load APACHE_EXPORTER_CLUSTERS. {e}')
-            cluster_xpaths = None
-
-        for cluster in cluster_xpaths:
-            h = 0
-            for row in root.xpath(cluster_xpaths[cluster]):
-                if h == 0:
-                    h += 1
-                    continue
-                else:                    
-                    host = "%s" % row[1].text
-                    route = "%s" % row[3].text
-                    status = row[2].text
-                    acc = row[7].text
-                    wr = self.str_to_bytes(row[8].text)
-                    rd =  self.str_to_bytes(row[9].text)
-
-                #  Update nodes statuses
-                ok, dis, err, unk = 0, 0, 0, 0
-                if status.find('Ok') >= 0:
-                    ok = 1                    
-                elif status.find('Dis') >= 0:
-                    dis = 1
-                elif status.find('Err') >= 0:
-                    err = 1
+        if 'balancer' in modules:
+            with self.stats.timer('balancer') as timer:
+                source = self.balancer_source
+                if source == 'manager' and page.balancer is not None:
+                    members = self.balancer.from_tree(
+                        html.fromstring(page.balancer)
+                    )
+                elif source == 'xpaths' and root is not None:
+                    members = self.balancer.from_xpaths(root,
+                                                        config.clusters)
+                elif source == 'discovery' and root is not None:
+                    members = self.balancer.from_tree(root)
+                elif source == 'discovery' and auto_status is not None:
+                    members = self.balancer.from_auto(auto_status)
                 else:
-                    unk = 1
-                #  Route statuses
-                route_ok.add_metric([cluster,host,route,exporter_name], ok)
-                route_dis.add_metric([cluster,host,route,exporter_name], dis)
-                route_err.add_metric([cluster,host,route,exporter_name], err)
-                route_unk.add_metric([cluster,host,route,exporter_name], unk)
-                #  Update requests, wr, rd counters
-                balancer_acc.add_metric([cluster,host,route,exporter_name], 
-                                        int(acc))
-                balancer_wr.add_metric([cluster,host,route,exporter_name], 
-                                        int(wr))
-                balancer_rd.add_metric([cluster,host,route,exporter_name], 
-                                        int(rd))
-        duration = float("%.3g" % (time.clock()-start))
-        latest_scrape.add_metric(['apache_balancer_route_ok',
-                                 exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_balancer_route_disabled',
-                                 exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_balancer_route_error',
-                                 exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_balancer_route_unknown',
-                                 exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_balancer_requests_total',
-                                 exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_balancer_write_bytes_total',
-                                 exporter_name], 
-                                 duration)
-        latest_scrape.add_metric(['apache_balancer_read_bytes_total',
-                                 exporter_name], 
-                                 duration)
+                    members = []
+                if self.balancer.errors:
+                    self.stats.add_error('balancer')
+                    for error in self.balancer.errors:
+                        self.logger.warning(error)
+                self.stats.add_rows(len(members))
+
+                #  Unchanged members are the same objects as on the
+                #  previous scrape, so families are compared cheaply
+                inputs = (exporter_name, tuple(members))
+                cached = self.cached_families('balancer', inputs)
+                if cached is not None:
+                    route_ok, route_dis, route_err, route_unk, \
+                        balancer_acc, balancer_wr, balancer_rd = cached
+                else:
+                    for member in members:
+                        labels = [member.cluster, member.host, member.route,
+                                  exporter_name]
+                        #  Route statuses
+                        route_ok.add_metric(labels, member.ok)
+                        route_dis.add_metric(labels, member.disabled)
+                        route_err.add_metric(labels, member.error)
+                        route_unk.add_metric(labels, member.unknown)
+                        #  Update requests, wr, rd counters
+                        balancer_acc.add_metric(labels, member.requests)
+                        balancer_wr.add_metric(labels, member.written)
+                        balancer_rd.add_metric(labels, member.read)
+                    self.families['balancer'] = (inputs, (
+                        route_ok, route_dis, route_err, route_unk,
+                        balancer_acc, balancer_wr, balancer_rd
+                    ))
+            latest_scrape.add_metric(['apache_balancer_route_ok',
+                                     exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_balancer_route_disabled',
+                                     exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_balancer_route_error',
+                                     exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_balancer_route_unknown',
+                                     exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_balancer_requests_total',
+                                     exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_balancer_write_bytes_total',
+                                     exporter_name], 
+                                     timer.duration)
+            latest_scrape.add_metric(['apache_balancer_read_bytes_total',
+                                     exporter_name], 
+                                     timer.duration)
 
         #  Get response time by endpoints
-        start = time.clock()        
-        h = 0
-        for row in root.xpath('/html/body/table[1]/tr'):
-            last_column = len(row)
-            if h == 0:
-                h += 1
-                for h in range(0,last_column):
-                    header = row[h].text.upper()
-                    if header == 'REQ':
-                        req_pos = h
-                    elif header == 'REQUEST':
-                        request_pos = h
-                continue
-            else:
-                try:
-                    duration = float(row[req_pos].text) / 1000
-                    url = ("%s" % row[request_pos].text).strip()
-                    method, url = self.sanitize_url(url)
-                    if method is not None and url is not None:
-                        self.put_histogram_values(method, url, duration)
-                except:
-                    pass
-        
-        #  group buckets into one list
-        url_buckets = {}
-        for i in self.url_count:
-            if (i[0],i[1]) not in url_buckets:
-                url_buckets[i[0],i[1]] = [[i[2],self.url_count[i]]]
-            else:
-                url_buckets[i[0],i[1]].append([i[2],self.url_count[i]])
-        
-        for t in url_buckets:
-            if (t[0], t[1]) in self.url_sum:
-                endpoint_response_time.add_metric([t[0], t[1], exporter_name],
-                                                  buckets=url_buckets[t],
-                                                  sum_value=self.url_sum[t[0], 
-                                                                         t[1]])
-        duration = float("%.3g" % (time.clock()-start))
-        latest_scrape.add_metric(['apache_endpoint_response_time_seconds',
-                                 exporter_name], 
-                                 duration)
+        if 'endpoints' in modules:
+            with self.stats.timer('endpoints') as timer:
+                rows = WORKER_ROWS(root) if root is not None else []
+                self.stats.add_rows(len(rows))
+                positions = {}
+                requests = []
+                for row in rows:
+                    if not positions:
+                        for pos, cell in enumerate(row):
+                            positions[(cell.text or '').strip().upper()] = \
+                                pos
+                        if 'REQ' not in positions \
+                            or 'REQUEST' not in positions:
+                            break
+                        continue
+                    try:
+                        if 'M' in positions and ''.join(
+                            row[positions['M']].itertext()
+                        ).strip() not in FINISHED_MODES:
+                            continue
+                        duration = float(row[positions['REQ']].text) / 1000
+                        request = \
+                            ("%s" % row[positions['REQUEST']].text).strip()
+                        method, url = self.sanitize_url(request)
+                        if method is not None and url is not None:
+                            #  Same worker slot, pid and slot accesses
+                            #  means the same request seen again
+                            identity = (request,)
+                            for column in ('SRV', 'PID', 'ACC'):
+                                if column in positions:
+                                    cell = row[positions[column]]
+                                    identity += (
+                                        cell.text if cell.text is not None
+                                        else ''.join(cell.itertext()),
+                                    )
+                            requests.append((identity, method, url,
+                                             duration))
+                    except:
+                        pass
+                self.endpoints.update(requests)
+
+                inputs = (exporter_name, self.endpoints,
+                          self.endpoints.version)
+                cached = self.cached_families('endpoints', inputs)
+                if cached is not None:
+                    endpoint_response_time, = cached
+                else:
+                    for method, url, buckets, sum_value in \
+                        self.endpoints.samples():
+                        endpoint_response_time.add_metric(
+                            [method, url, exporter_name],
+                            buckets=buckets, sum_value=sum_value
+                        )
+                    self.families['endpoints'] = (inputs,
+                                                  (endpoint_response_time,))
+            latest_scrape.add_metric(['apache_endpoint_response_time_seconds',
+                                     exporter_name], 
+                                     timer.duration)
 
+        #  Families of modules which were not run are left out
+        totals, balancer = 'totals' in modules, 'balancer' in modules
+        yield up
         #  counters
-        yield accesses_total
-        yield traffic_total
-        yield balancer_acc
-        yield balancer_wr
-        yield balancer_rd
+        if totals:
+            yield accesses_total
+            yield traffic_total
+        if balancer:
+            yield balancer_acc
+            yield balancer_wr
+            yield balancer_rd
         #  gauges
-        yield requests_sec
-        yield bytes_sec
-        yield bytes_request
-        yield route_ok
-        yield route_dis
-        yield route_err
-        yield route_unk
-        yield scoreboard
+        if totals:
+            yield requests_sec
+            yield bytes_sec
+            yield bytes_request
+            if self.uptime is not None:
+                yield uptime
+        if balancer:
+            yield route_ok
+            yield route_dis
+            yield route_err
+            yield route_unk
+        if 'scoreboard' in modules:
+            yield scoreboard
+        if 'workers' in modules:
+            yield scoreboard_process
         yield latest_scrape
         yield operation_duration
+        yield http_requests
+        yield http_connections
+        yield http_not_modified
         #  histograms
-        if self.endpoint_stats:
+        if 'endpoints' in modules:
             yield endpoint_response_time
+        #  exporter self-instrumentation
+        yield from self.breaker.collect(exporter_name)
+        yield from self.stats.collect(exporter_name)
@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import jsonschema
+from lxml import etree
+from collections import namedtuple
+from tornado.ioloop import PeriodicCallback
+
+#  Extractor modules of the collector
+MODULES = ('totals', 'scoreboard', 'workers', 'balancer', 'endpoints')
+
+#  Settings are read from environment variables of the same name and
+#  can be overridden by the JSON object in APACHE_EXPORTER_CONFIG file
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'APACHE_EXPORTER_URL': {'type': 'string', 'minLength': 1},
+        'APACHE_EXPORTER_NAME': {'type': 'string'},
+        'APACHE_EXPORTER_CLUSTERS': {
+            'type': 'object',
+            'additionalProperties': {'type': 'string'},
+        },
+        'APACHE_BALANCER_DISCOVERY': {'type': 'boolean'},
+        'APACHE_BALANCER_MANAGER_URL': {'type': 'string', 'minLength': 1},
+        'APACHE_URL_SUBSTRACT_RULES': {
+            'type': 'array', 'items': {'type': 'string'},
+        },
+        'APACHE_URL_TEMPLATES': {
+            'type': 'array', 'items': {'type': 'string'},
+        },
+        'APACHE_URL_REGEX_RULES': {
+            'type': 'array',
+            'items': {
+                'type': 'array', 'items': {'type': 'string'},
+                'minItems': 2, 'maxItems': 2,
+            },
+        },
+        'APACHE_URL_CACHE_SIZE': {'type': 'integer', 'minimum': 0},
+        'APACHE_ENDPOINT_STATISTICS': {'type': 'boolean'},
+        'APACHE_ENDPOINT_BUCKETS': {
+            'type': 'array', 'items': {'type': 'number'}, 'minItems': 1,
+        },
+        'APACHE_ENDPOINT_MAX_SERIES': {'type': 'integer', 'minimum': 1},
+        'APACHE_SCOREBOARD_THREAD_LIMIT': {'type': 'integer', 'minimum': 0},
+        'APACHE_EXPORTER_MODULES': {
+            'type': 'array', 'items': {'enum': list(MODULES)},
+            'uniqueItems': True,
+        },
+        'APACHE_EXPORTER_ASYNC': {'type': 'boolean'},
+        'APACHE_EXPORTER_TIMEOUT': {
+            'type': 'number', 'minimum': 0, 'exclusiveMinimum': True,
+        },
+        'APACHE_EXPORTER_CONNECT_TIMEOUT': {
+            'type': 'number', 'minimum': 0, 'exclusiveMinimum': True,
+        },
+        'APACHE_EXPORTER_POOL_SIZE': {'type': 'integer', 'minimum': 1},
+        'APACHE_EXPORTER_BREAKER_FAILURES': {'type': 'integer', 'minimum': 1},
+        'APACHE_EXPORTER_BREAKER_BACKOFF': {
+            'type': 'number', 'minimum': 0, 'exclusiveMinimum': True,
+        },
+        'APACHE_EXPORTER_BREAKER_MAX_BACKOFF': {
+            'type': 'number', 'minimum': 0, 'exclusiveMinimum': True,
+        },
+        'APACHE_EXPORTER_PARSER': {'enum': ['html', 'auto', 'stream']},
+        'APACHE_EXPORTER_POLL_INTERVAL': {'type': 'number', 'minimum': 0},
+        'APACHE_EXPORTER_TARGETS': {'type': 'string'},
+        'APACHE_EXPORTER_CONCURRENCY': {'type': 'integer', 'minimum': 1},
+        'APACHE_EXPORTER_PROCESSES': {'type': 'integer', 'minimum': 1},
+        'APACHE_EXPORTER_PROFILING': {'type': 'boolean'},
+    },
+}
+
+#  Setting -> Config field and default value
+FIELDS = (
+    ('APACHE_EXPORTER_URL', 'url', None),
+    ('APACHE_EXPORTER_NAME', 'name', 'none'),
+    ('APACHE_EXPORTER_CLUSTERS', 'clusters', None),
+    ('APACHE_BALANCER_DISCOVERY', 'balancer_discovery', True),
+    ('APACHE_BALANCER_MANAGER_URL', 'balancer_manager_url', None),
+    ('APACHE_URL_SUBSTRACT_RULES', 'url_substract_rules', None),
+    ('APACHE_URL_TEMPLATES', 'url_templates', None),
+    ('APACHE_URL_REGEX_RULES', 'url_regex_rules', None),
+    ('APACHE_URL_CACHE_SIZE', 'url_cache_size', 4096),
+    ('APACHE_ENDPOINT_STATISTICS', 'endpoint_stats', False),
+    ('APACHE_ENDPOINT_BUCKETS', 'endpoint_buckets', None),
+    ('APACHE_ENDPOINT_MAX_SERIES', 'endpoint_max_series', 1000),
+    ('APACHE_SCOREBOARD_THREAD_LIMIT', 'scoreboard_thread_limit', 0),
+    ('APACHE_EXPORTER_MODULES', 'modules', MODULES),
+    ('APACHE_EXPORTER_ASYNC', 'async_mode', False),
+    ('APACHE_EXPORTER_TIMEOUT', 'timeout', 10.0),
+    ('APACHE_EXPORTER_CONNECT_TIMEOUT', 'connect_timeout', None),
+    ('APACHE_EXPORTER_POOL_SIZE', 'pool_size', 4),
+    ('APACHE_EXPORTER_BREAKER_FAILURES', 'breaker_failures', 3),
+    ('APACHE_EXPORTER_BREAKER_BACKOFF', 'breaker_backoff', 5.0),
+    ('APACHE_EXPORTER_BREAKER_MAX_BACKOFF', 'breaker_max_backoff', 300.0),
+    ('APACHE_EXPORTER_PARSER', 'parser', 'html'),
+    ('APACHE_EXPORTER_POLL_INTERVAL', 'poll_interval', 0),
+    ('APACHE_EXPORTER_TARGETS', 'targets', None),
+    ('APACHE_EXPORTER_CONCURRENCY', 'concurrency', 8),
+    ('APACHE_EXPORTER_PROCESSES', 'processes', 1),
+    ('APACHE_EXPORTER_PROFILING', 'profiling', False),
+)
+
+#  Settings applied only on start
+RESTART_FIELDS = ('async_mode', 'poll_interval', 'targets', 'concurrency',
+                  'processes', 'profiling')
+
+#  Immutable settings, lists are converted to tuples.
+#  clusters - tuple of Cluster, url_regex_rules - compiled patterns
+Config = namedtuple('Config', [field for _, field, _ in FIELDS])
+
+#  Balancer cluster and its precompiled rows XPath
+Cluster = namedtuple('Cluster', ['name', 'xpath', 'rows'])
+
+
+def parse_env(value, schema):
+    """ Convert environment variable to the type expected by schema """
+    kind = schema.get('type')
+    if kind in ('object', 'array'):
+        return json.loads(value)
+    if kind == 'boolean':
+        return value.lower() == 'true'
+    if kind == 'integer':
+        return int(value)
+    if kind == 'number':
+        return float(value)
+    if 'enum' in schema:
+        return value.lower()
+    return value
+
+
+def read_settings(environ=None):
+    """ Return validated settings, list of (setting, error) and names of
+    settings read from the file. Invalid settings are left out, so
+    defaults are used for them """
+    environ = os.environ if environ is None else environ
+    properties = SCHEMA['properties']
+    settings, errors, from_file = {}, [], set()
+    for key, schema in properties.items():
+        if key in environ:
+            try:
+                settings[key] = parse_env(environ[key], schema)
+            except ValueError as e:
+                errors.append((key, f'Could not parse {key}. {e}'))
+
+    path = environ.get('APACHE_EXPORTER_CONFIG')
+    if path:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError('JSON object expected')
+            for key, value in data.items():
+                from_file.add(key)
+                if key in properties:
+                    settings[key] = value
+                else:
+                    errors.append((key, f'Unknown setting {key} in {path}'))
+        except (OSError, ValueError) as e:
+            from_file.add(None)
+            errors.append((None, f'Could not read {path}. {e}'))
+
+    validator = jsonschema.Draft4Validator(SCHEMA)
+    for error in validator.iter_errors(settings):
+        key = error.path[0] if error.path else None
+        errors.append((key, f'Invalid {key}. {error.message}'))
+        settings.pop(key, None)
+    return settings, errors, from_file
+
+
+def load_config(environ=None, strict=False):
+    """ Return Config with XPaths and regexes compiled, and errors.
+    strict - raise ValueError if the config file has errors, used on
+    reload to keep the current settings """
+    settings, errors, from_file = read_settings(environ)
+    values = {}
+    for key, field, default in FIELDS:
+        value = settings.get(key, default)
+        if isinstance(value, list):
+            value = tuple(tuple(v) if isinstance(v, list) else v
+                          for v in value)
+        values[field] = value
+
+    clusters = []
+    for name, xpath in (values['clusters'] or {}).items():
+        try:
+            clusters.append(Cluster(name, xpath, etree.XPath(xpath)))
+        except etree.XPathSyntaxError as e:
+            errors.append(('APACHE_EXPORTER_CLUSTERS',
+                           f'Invalid XPath of cluster {name}. {e}'))
+    values['clusters'] = tuple(clusters)
+
+    regex_rules = []
+    for pattern, replacement in values['url_regex_rules'] or ():
+        try:
+            regex_rules.append((re.compile(pattern), replacement))
+        except re.error as e:
+            errors.append(('APACHE_URL_REGEX_RULES',
+                           f'Invalid APACHE_URL_REGEX_RULES {pattern}. {e}'))
+    values['url_regex_rules'] = tuple(regex_rules)
+
+    if strict:
+        file_errors = [error for key, error in errors if key in from_file]
+        if file_errors:
+            raise ValueError(' '.join(file_errors))
+    return Config(**values), [error for _, error in errors]
+
+
+class ConfigWatcher(object):
+    """ Calls reload when APACHE_EXPORTER_CONFIG file is changed """
+    def __init__(self, path, reload, interval=5):
+        self.path = path
+        self.reload = reload
+        self.interval = interval
+        self.mtime = self.modified()
+
+
+    def modified(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+
+    def check(self):
+        mtime = self.modified()
+        if mtime != self.mtime:
+            self.mtime = mtime
+            self.reload()
+
+
+    def start(self):
+        PeriodicCallback(self.check, self.interval * 1000).start()
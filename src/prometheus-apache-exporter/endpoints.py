@@ -0,0 +1,100 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+DEFAULT_BUCKETS = [0.01, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+#  Labels of the series evicted endpoints are folded into
+OVERFLOW = ('OTHER', 'other')
+
+
+class EndpointStats(object):
+    """ Response time histograms by endpoint.
+    Worker rows repeat the last served request until the worker takes
+    a new one, so a request is observed only when it was not seen in
+    the previous scrape. Series count is capped, least recently seen
+    endpoints are folded into the overflow series """
+    def __init__(self, buckets=None, max_series=1000):
+        self.buckets = sorted(buckets or DEFAULT_BUCKETS)
+        self.bucket_names = [str(b) for b in self.buckets] + ['+Inf']
+        self.max_series = max_series
+        self.lock = threading.Lock()
+        #  (method, url) -> per-bucket counts, last one is +Inf
+        self.counts = OrderedDict()
+        #  (method, url) -> sum of durations
+        self.sums = {}
+        self.last_seen = set()
+        #  Incremented on every change, families are rebuilt only then
+        self.version = 0
+
+
+    def update(self, requests):
+        """ requests - iterable of (identity, method, url, duration)
+        for every worker row of the current scrape """
+        with self.lock:
+            seen = set()
+            for identity, method, url, duration in requests:
+                seen.add(identity)
+                if identity not in self.last_seen:
+                    self.observe((method, url), duration)
+            self.last_seen = seen
+
+
+    def observe(self, key, duration):
+        counts = self.counts.get(key)
+        if counts is None:
+            key, counts = self.add_series(key)
+        else:
+            self.counts.move_to_end(key)
+        pos = 0
+        while pos < len(self.buckets) and duration > self.buckets[pos]:
+            pos += 1
+        counts[pos] += 1
+        self.sums[key] += duration
+        self.version += 1
+
+
+    def add_series(self, key):
+        """ Return key and counts of a new series. The overflow series
+        counts against max_series too, when there is no room left the
+        key is folded into it """
+        while key != OVERFLOW and len(self.counts) >= self.max_series:
+            if not self.evict():
+                key = OVERFLOW
+                break
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = array('Q', [0] * len(self.bucket_names))
+            self.counts[key] = counts
+            self.sums[key] = 0.0
+        return key, counts
+
+
+    def evict(self):
+        """ Fold the least recently seen endpoint into the overflow series,
+        return False if there is no endpoint to fold """
+        key = next((k for k in self.counts if k != OVERFLOW), None)
+        if key is None:
+            return False
+        counts = self.counts.pop(key)
+        total = self.sums.pop(key)
+        _, overflow = self.add_series(OVERFLOW)
+        for i, value in enumerate(counts):
+            overflow[i] += value
+        self.sums[OVERFLOW] += total
+        self.version += 1
+        return True
+
+
+    def samples(self):
+        """ Return list of (method, url, buckets, sum) with cumulative
+        buckets as expected by HistogramMetricFamily """
+        result = []
+        with self.lock:
+            for key, counts in self.counts.items():
+                buckets, total = [], 0
+                for name, value in zip(self.bucket_names, counts):
+                    total += value
+                    buckets.append([name, total])
+                result.append((key[0], key[1], buckets, self.sums[key]))
+        return result
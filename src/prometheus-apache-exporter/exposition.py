@@ -0,0 +1,238 @@
+import copy
+import zlib
+import threading
+from collections import namedtuple
+from prometheus_client.utils import floatToGoString
+
+#  Text format 0.0.4 types of OpenMetrics families
+TYPES = {'info': 'gauge', 'stateset': 'gauge',
+         'gaugehistogram': 'histogram', 'unknown': 'untyped'}
+#  OpenMetrics samples exposed as separate gauges in text format
+SUFFIXES = ('_created', '_gsum', '_gcount')
+OPENMETRICS_EOF = b'# EOF\n'
+GZIP_LEVEL = 6
+
+#  Family object and its encoding, lines - (sample name, label values)
+#  -> (encoded name and labels, value, encoded line)
+EncodedFamily = namedtuple('EncodedFamily', ['family', 'body', 'lines'])
+
+
+def escape_label(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def encode_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (k, escape_label(v))
+                             for k, v in sorted(labels.items()))
+
+
+def gzip_accepted(accept_encoding):
+    """ Return True if Accept-Encoding header allows gzip """
+    for accepted in (accept_encoding or '').split(','):
+        coding, _, params = accepted.partition(';')
+        if coding.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+def gzip_compressor():
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def filter_families(families, names):
+    """ Families named in names[] of /metrics. A family name selects the
+    whole family, a sample name (e.g. "_bucket" or "_total") only its
+    samples, as prometheus_client does """
+    names = set(names)
+    for family in families:
+        if family.name in names:
+            yield family
+            continue
+        samples = [s for s in family.samples if s.name in names]
+        if samples:
+            selected = copy.copy(family)
+            selected.samples = samples
+            yield selected
+
+
+class ExpositionCache(object):
+    """ Text format 0.0.4 or OpenMetrics encoder, same output as
+    generate_latest of prometheus_client.
+    Encodings of the previous scrape are reused: a family object yielded
+    again, as collectors do for families with unchanged inputs, is not
+    encoded at all, other families encode only values of series seen
+    before and whole lines of new ones """
+    def __init__(self, openmetrics=False):
+        self.openmetrics = openmetrics
+        self.lock = threading.Lock()
+        #  family name -> EncodedFamily of the previous scrape
+        self.families = {}
+        #  Bytes of lines encoded by the latest generate, the rest reused
+        self.encoded_bytes = 0
+
+
+    def generate(self, families):
+        """ Return encoded families, without "# EOF" of OpenMetrics """
+        with self.lock:
+            encoded_families, output, encoded = {}, [], 0
+            for family in families:
+                cached = self.families.get(family.name)
+                if cached is None or cached.family is not family:
+                    cached, size = self.encode(
+                        family, cached.lines if cached is not None else {}
+                    )
+                    encoded += size
+                encoded_families[family.name] = cached
+                output.append(cached.body)
+            self.families = encoded_families
+            self.encoded_bytes = encoded
+            return b''.join(output)
+
+
+    def generate_once(self, families):
+        """ Encode families without touching encodings of scrapes """
+        return b''.join(self.encode(family, {})[0].body
+                        for family in families)
+
+
+    def header(self, family):
+        documentation = family.documentation.replace('\\', r'\\') \
+            .replace('\n', r'\n')
+        if self.openmetrics:
+            name = family.name
+            header = '# HELP %s %s\n# TYPE %s %s\n' % (
+                name, documentation.replace('"', r'\"'), name, family.type
+            )
+            if getattr(family, 'unit', ''):
+                header += '# UNIT %s %s\n' % (name, family.unit)
+            return header.encode('utf-8')
+
+        name, kind = family.name, family.type
+        if kind == 'counter':
+            name += '_total'
+        elif kind == 'info':
+            name += '_info'
+        kind = TYPES.get(kind, kind)
+        return f'# HELP {name} {documentation}\n' \
+            f'# TYPE {name} {kind}\n'.encode('utf-8')
+
+
+    def sample_tail(self, sample):
+        """ Timestamp and exemplar of the sample line """
+        tail = ''
+        if sample.timestamp is not None:
+            if self.openmetrics:
+                tail = ' %s' % sample.timestamp
+            else:
+                tail = ' %d' % int(float(sample.timestamp) * 1000)
+        exemplar = getattr(sample, 'exemplar', None)
+        if exemplar and self.openmetrics:
+            tail += ' # %s %s' % (encode_labels(exemplar.labels),
+                                  floatToGoString(exemplar.value))
+            if exemplar.timestamp is not None:
+                tail += ' %s' % exemplar.timestamp
+        return tail
+
+
+    def encode(self, family, previous):
+        """ Return EncodedFamily and bytes of lines encoded """
+        output = [self.header(family)]
+        lines, suffixed, encoded = {}, {}, 0
+        for sample in family.samples:
+            key = (sample.name, tuple(sample.labels.values()))
+            tail = self.sample_tail(sample) \
+                if sample.timestamp is not None \
+                or getattr(sample, 'exemplar', None) else ''
+            cached = previous.get(key)
+            if cached is not None and cached[1] == sample.value and not tail:
+                line = cached[2]
+            else:
+                if cached is not None:
+                    prefix = cached[0]
+                else:
+                    prefix = sample.name
+                    if sample.labels:
+                        prefix += encode_labels(sample.labels)
+                    prefix = (prefix + ' ').encode('utf-8')
+                value = floatToGoString(sample.value) + tail
+                line = prefix + value.encode('utf-8') + b'\n'
+                encoded += len(line)
+                cached = (prefix, sample.value, line)
+            lines[key] = cached
+
+            if not self.openmetrics:
+                for suffix in SUFFIXES:
+                    if sample.name == family.name + suffix:
+                        suffixed.setdefault(suffix, []).append(line)
+                        break
+                else:
+                    output.append(line)
+            else:
+                output.append(line)
+
+        for suffix, suffix_lines in sorted(suffixed.items()):
+            output.append(
+                f'# TYPE {family.name}{suffix} gauge\n'.encode('utf-8')
+            )
+            output.extend(suffix_lines)
+        return EncodedFamily(family, b''.join(output), lines), encoded
+
+
+class Exposition(object):
+    """ Metric families of one scrape, encoded on demand.
+    Plain and gzip-compressed bodies are cached per format, so repeated
+    requests for the same scrape are not encoded or compressed again.
+    Families added per request (the snapshot age) are compressed after
+    a copy of the compressor state of the cached body """
+    def __init__(self, families, encoders, stats=None):
+        self.families = families
+        #  openmetrics -> ExpositionCache of the collector
+        self.encoders = encoders
+        self.stats = stats
+        self.lock = threading.Lock()
+        #  openmetrics -> encoded families, without "# EOF"
+        self.bodies = {}
+        #  openmetrics -> (gzip of encoded families, compressor state)
+        self.compressed = {}
+
+
+    def encoded(self, openmetrics):
+        body = self.bodies.get(openmetrics)
+        if body is None:
+            encoder = self.encoders[openmetrics]
+            body = encoder.generate(self.families)
+            self.bodies[openmetrics] = body
+            if self.stats is not None:
+                self.stats.add_exposition(len(body), encoder.encoded_bytes)
+        return body
+
+
+    def body(self, openmetrics=False, compress=False, names=None,
+             extra=()):
+        """ Return the response body. names - families to select,
+        extra - families appended to this response only """
+        eof = OPENMETRICS_EOF if openmetrics else b''
+        encoder = self.encoders[openmetrics]
+        if names:
+            body = encoder.generate_once(filter_families(
+                list(self.families) + list(extra), names
+            )) + eof
+            if compress:
+                compressor = gzip_compressor()
+                body = compressor.compress(body) + compressor.flush()
+            return body
+
+        tail = encoder.generate_once(extra) + eof if extra else eof
+        with self.lock:
+            body = self.encoded(openmetrics)
+            if not compress:
+                return body + tail
+            cached = self.compressed.get(openmetrics)
+            if cached is None:
+                compressor = gzip_compressor()
+                cached = (compressor.compress(body)
+                          + compressor.flush(zlib.Z_SYNC_FLUSH), compressor)
+                self.compressed[openmetrics] = cached
+            compressor = cached[1].copy()
+        return cached[0] + compressor.compress(tail) + compressor.flush()
@@ -17,6 +17,7 @@ class ReadinessProbeHandler(tornado.web.RequestHandler):
         self.obj = ref_object
 
     def get(self):
+        #  ping reads states of breakers, no requests are sent
         res = self.obj.ping()
         if res == 1:        
             self.set_status(200)
@@ -0,0 +1,274 @@
+import io
+import time
+import threading
+import tornado.web
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+
+STAGE_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                 1.0, 2.5, 5.0, 10.0]
+
+
+class StageTimer(object):
+    """ Measures wall time of a scrape stage with perf_counter.
+    An exception raised inside the block is counted as a stage error """
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+        self.duration = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.stats.observe(self.stage, self.duration, exc_type is not None)
+        return False
+
+
+class ExporterStats(object):
+    """ Self-instrumentation kept across scrapes: stage duration
+    histograms, processed page bytes and rows, errors by stage,
+    detected counter resets and encoded exposition bytes """
+    def __init__(self, buckets=None):
+        self.buckets = sorted(buckets or STAGE_BUCKETS)
+        self.bucket_names = [str(b) for b in self.buckets] + ['+Inf']
+        self.lock = threading.Lock()
+        #  stage -> per-bucket counts, last one is +Inf
+        self.counts = OrderedDict()
+        self.sums = {}
+        self.errors = OrderedDict()
+        self.page_bytes = 0
+        self.rows = 0
+        self.counter_resets = 0
+        self.exposition_bytes = 0
+        self.encoded_bytes = 0
+
+
+    def timer(self, stage):
+        return StageTimer(self, stage)
+
+
+    def observe(self, stage, duration, failed=False):
+        with self.lock:
+            counts = self.counts.get(stage)
+            if counts is None:
+                counts = array('Q', [0] * len(self.bucket_names))
+                self.counts[stage] = counts
+                self.sums[stage] = 0.0
+                self.errors.setdefault(stage, 0)
+            pos = 0
+            while pos < len(self.buckets) and duration > self.buckets[pos]:
+                pos += 1
+            counts[pos] += 1
+            self.sums[stage] += duration
+            if failed:
+                self.errors[stage] += 1
+
+
+    def add_error(self, stage):
+        """ Count a failure which was handled inside of the stage """
+        with self.lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+
+    def add_page_bytes(self, size):
+        with self.lock:
+            self.page_bytes += size
+
+
+    def add_rows(self, rows):
+        with self.lock:
+            self.rows += rows
+
+
+    def add_counter_reset(self):
+        with self.lock:
+            self.counter_resets += 1
+
+
+    def add_exposition(self, size, encoded):
+        """ Count exposition bytes served and bytes of them encoded anew """
+        with self.lock:
+            self.exposition_bytes += size
+            self.encoded_bytes += encoded
+
+
+    def collect(self, exporter_name):
+        """ Yield metric families of the exporter itself """
+        stage_duration = HistogramMetricFamily(
+            'apache_exporter_stage_duration_seconds',
+            'Wall time of scrape stages',
+            labels=['stage', 'exporter_name']
+        )
+        page_bytes = CounterMetricFamily(
+            'apache_exporter_page_bytes_total',
+            'Bytes of status pages processed',
+            labels=['exporter_name']
+        )
+        rows = CounterMetricFamily(
+            'apache_exporter_rows_parsed_total',
+            'Worker and balancer table rows processed',
+            labels=['exporter_name']
+        )
+        errors = CounterMetricFamily(
+            'apache_exporter_scrape_errors_total',
+            'Scrape stages failed with an exception',
+            labels=['stage', 'exporter_name']
+        )
+        counter_resets = CounterMetricFamily(
+            'apache_exporter_counter_resets_total',
+            'Apache restarts detected by uptime going back, '
+            'counters of the status page started from zero',
+            labels=['exporter_name']
+        )
+        exposition_bytes = CounterMetricFamily(
+            'apache_exporter_exposition_bytes_total',
+            'Bytes of /metrics responses rendered',
+            labels=['exporter_name']
+        )
+        encoded_bytes = CounterMetricFamily(
+            'apache_exporter_encoded_bytes_total',
+            'Bytes of /metrics responses encoded anew, '
+            'the rest were reused from the previous scrape',
+            labels=['exporter_name']
+        )
+        with self.lock:
+            for stage, counts in self.counts.items():
+                buckets, total = [], 0
+                for name, value in zip(self.bucket_names, counts):
+                    total += value
+                    buckets.append([name, total])
+                stage_duration.add_metric([stage, exporter_name],
+                                          buckets=buckets,
+                                          sum_value=self.sums[stage])
+            for stage, count in self.errors.items():
+                errors.add_metric([stage, exporter_name], count)
+            page_bytes.add_metric([exporter_name], self.page_bytes)
+            rows.add_metric([exporter_name], self.rows)
+            counter_resets.add_metric([exporter_name], self.counter_resets)
+            exposition_bytes.add_metric([exporter_name],
+                                        self.exposition_bytes)
+            encoded_bytes.add_metric([exporter_name], self.encoded_bytes)
+        yield stage_duration
+        yield page_bytes
+        yield rows
+        yield errors
+        yield counter_resets
+        yield exposition_bytes
+        yield encoded_bytes
+
+
+class ScrapeProfiler(object):
+    """ Runs cProfile over the next N scrapes on demand, one session at
+    a time. Profiled calls are serialized, a Profile object is not
+    thread-safe. cProfile and pstats are imported on the first request
+    only """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+        self.profile = None
+        self.scrapes = 0
+        self.target = 0
+        #  Resolved on the IOLoop of the session once N scrapes are done
+        self.io_loop = None
+        self.done = None
+
+
+    def start(self, scrapes):
+        """ Start a session, return Future resolved after the scrapes.
+        Must be called on the IOLoop """
+        import cProfile
+        with self.lock:
+            if self.profile is not None:
+                raise RuntimeError('Profiling is already in progress')
+            self.profile = cProfile.Profile()
+            self.scrapes = 0
+            self.target = scrapes
+            self.io_loop = IOLoop.current()
+            self.done = Future()
+            return self.done
+
+
+    def run(self, function, *args):
+        """ Call function, under the profiler if profiling is active """
+        profile = self.profile
+        if profile is None:
+            return function(*args)
+        with self.run_lock:
+            return profile.runcall(function, *args)
+
+
+    def scrape_done(self):
+        """ Count a finished scrape, called from any thread """
+        with self.lock:
+            if self.profile is None:
+                return
+            self.scrapes += 1
+            if self.scrapes == self.target:
+                self.io_loop.add_callback(self.resolve, self.done)
+
+
+    @staticmethod
+    def resolve(future):
+        if not future.done():
+            future.set_result(None)
+
+
+    def stop(self, sort='cumulative', limit=50):
+        """ Stop profiling, return (scrapes profiled, stats text) """
+        import pstats
+        with self.lock:
+            profile, self.profile = self.profile, None
+            scrapes = self.scrapes
+        stream = io.StringIO()
+        with self.run_lock:
+            try:
+                stats = pstats.Stats(profile, stream=stream)
+                stats.sort_stats(sort).print_stats(limit)
+            except TypeError:
+                #  Nothing was profiled
+                pass
+        return scrapes, stream.getvalue()
+
+
+#  One profiler per process, shared by all collectors
+PROFILER = ScrapeProfiler()
+
+
+class ProfileHandler(tornado.web.RequestHandler):
+    """ Tornado Handler for /debug/profile?scrapes=N endpoint.
+    Profiles the next N scrapes and returns cProfile statistics """
+    async def get(self):
+        import pstats
+        try:
+            scrapes = int(self.get_argument('scrapes', '1'))
+            timeout = float(self.get_argument('timeout', '300'))
+            limit = int(self.get_argument('limit', '50'))
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        if scrapes < 1:
+            raise tornado.web.HTTPError(400, 'scrapes must be positive')
+        sort = self.get_argument('sort', 'cumulative')
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            raise tornado.web.HTTPError(400, 'Unknown sort key %s' % sort)
+
+        try:
+            done = PROFILER.start(scrapes)
+        except RuntimeError as e:
+            raise tornado.web.HTTPError(409, str(e))
+        try:
+            await gen.with_timeout(timedelta(seconds=timeout), done)
+        except gen.TimeoutError:
+            pass
+        finally:
+            profiled, stats = PROFILER.stop(sort, limit)
+        self.set_header('Content-Type', 'text/plain')
+        self.write('%d of %d scrapes profiled\n%s' % (profiled, scrapes,
+                                                       stats))
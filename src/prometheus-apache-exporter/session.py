@@ -0,0 +1,108 @@
+import requests
+import threading
+from requests.adapters import HTTPAdapter
+
+class PooledSession(object):
+    """ Keep-alive HTTP client of status page scrapes.
+    Sends conditional requests and reuses the last body on 304 """
+    def __init__(self, pool_size=4, timeout=10.0, connect_timeout=None,
+                 previous=None):
+        """ previous - session replaced by this one on reload, its
+        counters and validators are carried over """
+        self.timeout = (connect_timeout or timeout, timeout)
+        #  Status page and /balancer-manager may be on different hosts
+        self.adapter = HTTPAdapter(pool_connections=2,
+                                   pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.verify = False
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.lock = threading.Lock()
+        #  url -> (etag, last_modified, content)
+        self.validators = {}
+        self.not_modified = 0
+        #  Requests sent and connections opened by replaced sessions and
+        #  by pools the adapter closed
+        self.base = (0, 0)
+        #  Latest stats(), counters never go back while a pool is closed
+        self.reported = (0, 0)
+        if previous is not None:
+            requests_total, connections_total, self.not_modified = \
+                previous.stats()
+            self.base = (requests_total, connections_total)
+            with previous.lock:
+                self.validators = dict(previous.validators)
+        pools = self.adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def retire(pool):
+            with self.lock:
+                self.base = (self.base[0] + pool.num_requests,
+                             self.base[1] + pool.num_connections)
+            #  urllib3 2 leaves evicted pools to the garbage collector
+            if dispose is not None:
+                dispose(pool)
+        pools.dispose_func = retire
+
+
+    def get(self, url):
+        """ Fetch url, return the response body """
+        headers = {}
+        with self.lock:
+            etag, last_modified, content = \
+                self.validators.get(url, (None, None, None))
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(url, headers=headers,
+                                    timeout=self.timeout)
+        if response.status_code == requests.codes.not_modified \
+            and content is not None:
+            with self.lock:
+                self.not_modified += 1
+            return content
+        response.raise_for_status()
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self.lock:
+            if etag or last_modified:
+                self.validators[url] = (etag, last_modified,
+                                        response.content)
+            else:
+                self.validators.pop(url, None)
+        return response.content
+
+
+    def stream(self, url, chunk_size=2**16):
+        """ Fetch url, yield decoded response body by chunks """
+        with self.session.get(url, stream=True,
+                              timeout=self.timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size):
+                yield chunk
+
+
+    def close(self):
+        """ Close keep-alive connections """
+        self.session.close()
+
+
+    def stats(self):
+        """ Return count of requests sent, TCP connections opened and
+        responses reused on 304 """
+        pools = self.adapter.poolmanager.pools
+        with self.lock:
+            requests_total, connections_total = self.base
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_total += pool.num_requests
+                    connections_total += pool.num_connections
+            self.reported = (max(requests_total, self.reported[0]),
+                             max(connections_total, self.reported[1]))
+            return self.reported + (self.not_modified,)
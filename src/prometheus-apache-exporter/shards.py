@@ -0,0 +1,258 @@
+import zlib
+import signal
+import logging
+import multiprocessing
+from collections import OrderedDict
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+from collector import Collector, ScrapeCache
+from config import load_config
+from exposition import ExpositionCache, Exposition
+from targets import load_targets, merge_families, probe_collector, \
+    TargetsSnapshot
+
+#  State of a worker process: settings, collectors of its targets kept
+#  between scrapes and threads fetching status pages
+WORKER = {}
+
+
+def worker_init():
+    """ Set up a worker process. SIGINT of the terminal is handled by the
+    main process, it stops workers on shutdown """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    config, _ = load_config()
+    WORKER['config'] = config
+    WORKER['collectors'] = {}
+    WORKER['probes'] = OrderedDict()
+    WORKER['fetcher'] = ThreadPoolExecutor(config.concurrency)
+
+
+def worker_collector(target, keep=True):
+    """ Return collector of the target. Collectors of configured targets
+    are kept, those of other /probe urls only among the latest probed """
+    key = (target['url'], target.get('name', target['url']),
+           target.get('timeout'))
+    collector = WORKER['collectors'].get(key)
+    if collector is None and not keep:
+        collector, evicted = probe_collector(WORKER['probes'],
+                                             WORKER['config'], *key)
+        #  A worker runs one scrape at a time, evicted collectors have
+        #  no requests in flight
+        for old in evicted:
+            old.session.close()
+    elif collector is None:
+        collector = Collector(url=key[0], name=key[1], timeout=key[2],
+                              config=WORKER['config'])
+        WORKER['collectors'][key] = collector
+    return collector
+
+
+def worker_fetch(collector, modules):
+    try:
+        page, duration = collector.fetch_page(modules)
+    except Exception:
+        return None
+    return collector, page, duration
+
+
+def worker_scrape(targets, modules=None, keep=True):
+    """ Fetch and collect targets in the worker process, return their
+    merged families and availability of every target by its breaker """
+    collectors = [worker_collector(target, keep) for target in targets]
+    pages = WORKER['fetcher'].map(
+        lambda collector: worker_fetch(collector, modules), collectors
+    )
+    pages = [page for page in pages if page is not None]
+    return (list(TargetsSnapshot(pages, modules).collect()),
+            [collector.ping() for collector in collectors])
+
+
+def unavailable_families(names):
+    """ Families of targets whose worker did not return their scrape """
+    up = GaugeMetricFamily(
+        'apache_up',
+        'Apache status page was loaded on the scrape',
+        labels=['exporter_name']
+    )
+    for name in names:
+        up.add_metric([name], 0)
+    return [up]
+
+
+def worker_reload():
+    config, _ = load_config()
+    WORKER['config'] = config
+    for collector in list(WORKER['collectors'].values()) \
+            + list(WORKER['probes'].values()):
+        collector.reload(config)
+
+
+class ShardedTargetCollector(ScrapeCache):
+    """ Targets split between worker processes, so that status pages of
+    different targets are parsed on different cores.
+    Every target is always scraped by the same worker, its endpoint
+    histogram and counters are kept in one place. The main process serves
+    HTTP and merges families of the workers """
+    def __init__(self, path, config):
+        super().__init__()
+        self.logger = logging.getLogger(type(self).__name__)
+        self.config = config
+        self.name = config.name
+        self.poll_interval = config.poll_interval
+        self.modules = frozenset(config.modules)
+        #  Targets are always fetched with the non-blocking client
+        self.async_mode = True
+
+        targets = load_targets(path)
+        processes = max(1, min(config.processes, len(targets)))
+        #  Spawned, not forked: the main process runs threads
+        context = multiprocessing.get_context('spawn')
+        self.pools = [context.Pool(1, worker_init)
+                      for _ in range(processes)]
+        #  Targets of every worker, in order of the targets file
+        self.shards = [targets[i::processes] for i in range(processes)]
+
+        #  A worker is waited for as long as fetches of all its targets
+        #  can take, plus the same time for parsing
+        timeout = max([t.get('timeout') or config.timeout for t in targets]
+                      or [config.timeout])
+        rounds = -(-max(len(s) for s in self.shards) // config.concurrency)
+        self.task_timeout = timeout * (rounds + 1)
+        #  Target name -> encoders of /probe responses
+        self.probe_encoders = {}
+        #  Target name -> 1 if it was available on its latest scrape.
+        #  Workers send it with scrape results, readiness does not wait
+        #  for a worker busy with a scrape
+        self.available = dict((target.get('name', target['url']), 1)
+                              for target in targets)
+        #  Target name -> scrapes its worker failed or did not finish
+        #  in time
+        self.worker_errors = dict((name, 0) for name in self.available)
+
+
+    def run(self, index, function, *args):
+        """ Call function in the worker, return Future of its result """
+        io_loop = IOLoop.current()
+        future = Future()
+
+        def resolve(method, value):
+            if not future.done():
+                method(value)
+
+        self.pools[index].apply_async(
+            function, args,
+            callback=lambda result: io_loop.add_callback(
+                resolve, future.set_result, result),
+            error_callback=lambda e: io_loop.add_callback(
+                resolve, future.set_exception, e)
+        )
+        return gen.with_timeout(timedelta(seconds=self.task_timeout), future)
+
+
+    async def scrape_shard(self, index, targets, modules=None, keep=True):
+        try:
+            families, available = await self.run(
+                index, worker_scrape, targets, modules, keep
+            )
+        except Exception as e:
+            self.logger.error(f'Worker {index} failed to scrape. '
+                              f'Exception: {e!r}')
+            names = [target.get('name', target['url']) for target in targets]
+            if keep:
+                for name in names:
+                    self.worker_errors[name] += 1
+                    self.available[name] = 0
+            return unavailable_families(names)
+        if keep:
+            for target, value in zip(targets, available):
+                self.available[target.get('name', target['url'])] = value
+        return families
+
+
+    def worker_errors_family(self, names):
+        """ Failed scrapes of the workers by target, counted by the main
+        process as a scrape stage of the target """
+        errors = CounterMetricFamily(
+            'apache_exporter_scrape_errors_total',
+            'Scrape stages failed with an exception',
+            labels=['stage', 'exporter_name']
+        )
+        for name in names:
+            errors.add_metric(['worker', name], self.worker_errors[name])
+        return errors
+
+
+    async def scrape(self, modules=None):
+        results = await gen.multi([
+            self.scrape_shard(index, targets, modules)
+            for index, targets in enumerate(self.shards)
+        ])
+        results.append([self.worker_errors_family(self.worker_errors)])
+        return self.exposition(list(merge_families(results)))
+
+
+    def find_target(self, target):
+        """ Return worker index and configured target by name or url """
+        for field in ('name', 'url'):
+            for index, targets in enumerate(self.shards):
+                for spec in targets:
+                    if spec.get(field, spec['url']) == target:
+                        return index, spec
+        return None, None
+
+
+    async def probe(self, target, name=None, modules=None):
+        """ Return Exposition of one target. Unknown urls are scraped by
+        the worker their url hashes to, without endpoint history """
+        index, spec = self.find_target(target)
+        if spec is not None:
+            name = spec.get('name', spec['url'])
+            families = list(merge_families([
+                await self.scrape_shard(index, [spec], modules),
+                [self.worker_errors_family([name])]
+            ]))
+            encoders = self.probe_encoders.setdefault(
+                name,
+                {False: ExpositionCache(), True: ExpositionCache(True)}
+            )
+        else:
+            index = zlib.crc32(target.encode('utf-8')) % len(self.pools)
+            families = await self.scrape_shard(
+                index, [{'url': target, 'name': name or target}], modules,
+                keep=False
+            )
+            encoders = {False: ExpositionCache(), True: ExpositionCache(True)}
+        return Exposition(families, encoders)
+
+
+    def ping(self):
+        """ Ready as long as any of the targets was available on its
+        latest scrape """
+        return 1 if any(self.available.values()) else 0
+
+
+    def reload(self, config=None):
+        """ Reload settings in every worker, target list and number of
+        workers are read only on start """
+        if config is None:
+            try:
+                config, _ = load_config(strict=True)
+            except ValueError as e:
+                self.logger.error(f'Config is not reloaded. {e}')
+                return False
+        self.config = config
+        self.modules = frozenset(config.modules)
+        for pool in self.pools:
+            pool.apply_async(worker_reload)
+        return True
+
+
+    async def close(self, timeout=10):
+        await super().close(timeout)
+        for pool in self.pools:
+            pool.terminate()
@@ -0,0 +1,22 @@
+import re
+from functools import lru_cache
+
+#  Sizes printed by mod_status: "512 ", "5.2K", " 10M" in balancer tables
+#  (apr_strfsize), "342 B", "4.6 kB", "5.6 GB" in totals and rates
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*([KMGTPE]?)B?\s*$',
+                     re.IGNORECASE)
+
+UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40,
+         'P': 2**50, 'E': 2**60}
+
+
+@lru_cache(maxsize=4096)
+def parse_size(value):
+    """ Converts size string to bytes, raises ValueError if it is not a
+    size. Results are memoized, balancer cells mostly repeat between
+    scrapes """
+    match = SIZE_RE.match(value)
+    if match is None:
+        raise ValueError(f'Invalid size {value!r}')
+    number, unit = match.groups()
+    return float(number) * UNITS[unit.upper()]
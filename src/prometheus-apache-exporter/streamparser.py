@@ -0,0 +1,117 @@
+import re
+from lxml import etree
+
+#  Cluster XPaths of this form can be resolved while streaming
+TABLE_XPATH = re.compile(r'^/html/body/table\[(\d+)\](/tr)?$')
+
+#  Body-level elements metrics are read from
+KEEP_TAGS = ('dl', 'pre', 'table')
+
+#  Only events of these tags are handled, cell events are not needed
+EVENT_TAGS = ('dl', 'pre', 'table', 'tr', 'h1', 'h2', 'h3', 'p', 'hr',
+              'address', 'form')
+
+#  Worker table columns used for endpoint statistics
+ENDPOINT_COLUMNS = ('SRV', 'PID', 'ACC', 'M', 'REQ', 'REQUEST')
+
+
+class StreamingParser(object):
+    """ Builds a pruned /server-status tree from a streamed body.
+    Elements which metrics are not read from are emptied as soon as
+    they are parsed, so the full DOM is never held in memory.
+    The pruned tree keeps element positions, existing XPaths work on it """
+    def __init__(self, tables=None, endpoint_table=None, balancers=False,
+                 keep=KEEP_TAGS):
+        """ tables - body-level table indexes (1-based) to keep rows of,
+        None keeps all tables. endpoint_table - index of the worker table,
+        only Req and Request cells of its rows are kept. balancers - keep
+        "balancer://" headings and tables which follow them. keep -
+        body-level tags not emptied, tables are pruned by rows anyway """
+        self.tables = tables
+        self.keep = keep
+        self.endpoint_table = endpoint_table
+        self.balancers = balancers
+        self.in_balancer = False
+        self.parser = etree.HTMLPullParser(events=('start', 'end'),
+                                           tag=EVENT_TAGS)
+        self.table_index = 0
+        self.table = None
+        self.drop_rows = False
+        self.columns = None
+
+
+    @staticmethod
+    def table_indexes(xpaths):
+        """ Return table indexes referenced by cluster XPaths or None
+        if any of them can not be resolved while streaming """
+        indexes = set()
+        for xpath in xpaths:
+            match = TABLE_XPATH.match(xpath.strip())
+            if match is None:
+                return None
+            indexes.add(int(match.group(1)))
+        return indexes
+
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self.process_events()
+
+
+    def close(self):
+        """ Finish parsing and return the root element """
+        root = self.parser.close()
+        self.process_events()
+        return root
+
+
+    def process_events(self):
+        for event, elem in self.parser.read_events():
+            parent = elem.getparent()
+            in_body = parent is not None and parent.tag == 'body'
+            if event == 'start':
+                if in_body and elem.tag == 'table':
+                    self.start_table(elem)
+                continue
+
+            if in_body and elem.tag not in self.keep:
+                if self.balancers and elem.tag in ('h1', 'h2', 'h3'):
+                    self.in_balancer = 'balancer://' in \
+                        ''.join(elem.itertext())
+                    if self.in_balancer:
+                        continue
+                elem.clear()
+            elif elem.tag == 'tr' and parent is self.table:
+                self.end_row(elem, parent)
+
+
+    def start_table(self, elem):
+        self.table_index += 1
+        self.table = elem
+        self.columns = None
+        if self.table_index == self.endpoint_table:
+            self.drop_rows = False
+        elif self.tables is None or self.in_balancer:
+            self.drop_rows = False
+        else:
+            self.drop_rows = self.table_index not in self.tables
+
+
+    def end_row(self, row, table):
+        if self.drop_rows:
+            #  Keep only the latest row to not shift positions of others
+            row.clear()
+            while row.getprevious() is not None:
+                del table[0]
+        elif self.table_index == self.endpoint_table \
+            and (self.tables is None or self.table_index not in self.tables):
+            #  Header row is pruned the same way, so column positions
+            #  found from it still match the data rows
+            if self.columns is None:
+                self.columns = set(
+                    i for i, cell in enumerate(row)
+                    if (cell.text or '').strip().upper() in ENDPOINT_COLUMNS
+                )
+            for i in reversed(range(len(row))):
+                if i not in self.columns:
+                    del row[i]
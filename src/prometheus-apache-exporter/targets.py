@@ -0,0 +1,219 @@
+import copy
+import json
+import logging
+from collections import OrderedDict
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+
+from collector import Collector, ScrapeCache, ExpositionHandler
+from config import load_config
+from profiling import PROFILER
+
+#  Collectors of /probe urls which are not configured targets are kept
+#  for their breakers and connections, the least recently probed ones
+#  are closed above this number
+PROBE_COLLECTORS = 32
+
+class ProbeHandler(ExpositionHandler):
+    """ Tornado Handler for /probe?target= endpoint """
+    async def get(self):
+        target = self.get_argument('target')
+        name = self.get_argument('name', None)
+        modules = self.selected_modules(self.obj)
+        await self.write_exposition(await self.obj.probe(
+            target, name, modules if modules != self.obj.modules else None
+        ))
+
+
+def load_targets(path):
+    """ Return targets of the JSON file, exit if it can not be read """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        logging.getLogger('Targets').error(
+            f'Cannot load targets from {path}. {e}'
+        )
+        raise SystemExit
+
+
+def probe_collector(probes, config, url, name=None, timeout=None):
+    """ Return collector of a /probe url from the probes OrderedDict and
+    the collectors evicted to keep at most PROBE_COLLECTORS of them.
+    The caller closes evicted collectors """
+    key = (url, name or url, timeout)
+    collector = probes.get(key)
+    if collector is not None:
+        probes.move_to_end(key)
+        return collector, []
+    collector = Collector(url=url, name=key[1], timeout=timeout,
+                          config=config)
+    probes[key] = collector
+    evicted = []
+    while len(probes) > PROBE_COLLECTORS:
+        evicted.append(probes.popitem(last=False)[1])
+    return collector, evicted
+
+
+def merge_families(groups):
+    """ Merge families of several targets into one exposition.
+    Families with the same name are merged into a copy, so every metric
+    has a single HELP/TYPE header and families collectors keep for the
+    next scrape are not changed """
+    families, copies = OrderedDict(), set()
+    for group in groups:
+        for metric in group:
+            merged = families.get(metric.name)
+            if merged is not None:
+                if metric.name not in copies:
+                    merged = copy.copy(merged)
+                    merged.samples = list(merged.samples)
+                    families[metric.name] = merged
+                    copies.add(metric.name)
+                merged.samples.extend(metric.samples)
+            else:
+                families[metric.name] = metric
+    return iter(families.values())
+
+
+class TargetsSnapshot(object):
+    """ Status pages of several targets rendered as one exposition """
+    def __init__(self, pages, modules=None):
+        self.pages = pages
+        self.modules = modules
+
+    def collect(self):
+        return merge_families(self.collect_targets())
+
+    def collect_targets(self):
+        for collector, page, duration in self.pages:
+            try:
+                yield list(collector.collect_page(page, duration,
+                                                  self.modules))
+            except Exception as e:
+                collector.logger.error(
+                    f'Failed to collect {collector.name}. Exception: {e}'
+                )
+
+
+class MultiTargetCollector(ScrapeCache):
+    """ Scrapes many Apache instances from one process.
+    Targets are read from a JSON file:
+    [{"name": "host1", "url": "https://host1/server-status", "timeout": 5}]
+    """
+    def __init__(self, path, config=None):
+        super().__init__()
+        self.logger = logging.getLogger(type(self).__name__)
+
+        if config is None:
+            config, errors = load_config()
+            for error in errors:
+                self.logger.warning(error)
+        self.config = config
+
+        self.targets = OrderedDict()
+        #  Collectors of probed urls which are not targets, oldest first
+        self.probes = OrderedDict()
+        for target in load_targets(path):
+            collector = Collector(url=target['url'],
+                                  name=target.get('name', target['url']),
+                                  timeout=target.get('timeout'),
+                                  config=config)
+            self.targets[collector.name] = collector
+
+        #  Maximum number of status pages fetched at the same time
+        self.concurrency = config.concurrency
+        self.semaphore = Semaphore(self.concurrency)
+        self.name = config.name
+        self.poll_interval = config.poll_interval
+        #  Modules selectable per scrape, every target runs those of them
+        #  it has settings for
+        self.modules = frozenset(config.modules)
+
+        #  Targets are always fetched with the non-blocking client
+        self.async_mode = True
+
+
+    def get_target(self, target, name=None):
+        """ Find configured target by name or url. Unknown urls get
+        a collector of their own, kept among the latest PROBE_COLLECTORS
+        probed ones """
+        if target in self.targets:
+            return self.targets[target]
+        for collector in self.targets.values():
+            if collector.url == target:
+                return collector
+        collector, evicted = probe_collector(self.probes, self.config,
+                                             target, name)
+        for old in evicted:
+            IOLoop.current().spawn_callback(old.close)
+        return collector
+
+
+    async def probe(self, target, name=None, modules=None):
+        """ Return Exposition of one target, only of the modules when
+        they are given. Probes count against the concurrency of scrapes """
+        collector = self.get_target(target, name)
+        #  An evicted collector is closed once its probes are finished
+        collector.requests += 1
+        try:
+            async with self.semaphore:
+                if modules is not None:
+                    return await collector.scrape_modules(modules)
+                return await collector.generate_latest_scrape_async()
+        finally:
+            collector.requests -= 1
+
+
+    def reload(self, config=None):
+        """ Apply reloaded settings to every target, target list is
+        read only on start """
+        if config is None:
+            try:
+                config, _ = load_config(strict=True)
+            except ValueError as e:
+                self.logger.error(f'Config is not reloaded. {e}')
+                return False
+        self.config = config
+        self.modules = frozenset(config.modules)
+        for collector in self.targets.values():
+            collector.reload(config)
+        for collector in self.probes.values():
+            collector.reload(config)
+        return True
+
+
+    async def fetch_target(self, collector, modules=None):
+        async with self.semaphore:
+            try:
+                page, duration = await collector.fetch(modules)
+            except Exception:
+                return None
+        return collector, page, duration
+
+
+    async def scrape(self, modules=None):
+        pages = await gen.multi(
+            [self.fetch_target(c, modules) for c in self.targets.values()]
+        )
+        pages = [page for page in pages if page is not None]
+        return await IOLoop.current().run_in_executor(
+            None, PROFILER.run, self.collect_exposition,
+            TargetsSnapshot(pages, modules)
+        )
+
+
+    async def close(self, timeout=10):
+        await super().close(timeout)
+        await gen.multi([collector.close(timeout) for collector in
+                         list(self.targets.values())
+                         + list(self.probes.values())])
+
+
+    def ping(self):
+        """ Ready as long as any of the targets is available """
+        for collector in self.targets.values():
+            if collector.ping() == 1:
+                return 1
+        return 0
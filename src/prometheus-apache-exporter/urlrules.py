@@ -0,0 +1,87 @@
+import re
+from functools import lru_cache
+
+#  {name} placeholder of a template rule matches one path segment
+PLACEHOLDER = re.compile(r'\{[^/{}]+\}')
+SEGMENT = r'[^/?;\s]+'
+#  Method, path and optional protocol of a request line, the protocol
+#  is missing when mod_status truncates long lines
+REQUEST_LINE = re.compile(r'(\S+) (.*?)(?:\s+HTTP/[\d.]+)?\s*$')
+
+
+class UrlNormalizer(object):
+    """ Turns a request line into (method, endpoint).
+    Rules are compiled once, results are memoized in a bounded LRU.
+    Only the path of the request line is normalized, without the
+    protocol. Rules are applied in order:
+    * the first 4 path contexts are kept
+    * substract rules - substrings followed by dynamic content,
+      the url is cut after the first of them
+    * templates - "/users/{id}" replaces "/users/42" at url start
+    * regex rules - [pattern, replacement] pairs for re.sub """
+    def __init__(self, substract_rules=None, templates=None,
+                 regex_rules=None, cache_size=4096):
+        self.substract = None
+        if any(substract_rules or []):
+            self.substract = re.compile('|'.join(
+                re.escape(rule) for rule in
+                sorted(substract_rules, key=len) if rule
+            ))
+
+        self.templates = []
+        self.template = None
+        if templates:
+            groups = []
+            for template in templates:
+                pattern = ''
+                pos = 0
+                for match in PLACEHOLDER.finditer(template):
+                    pattern += re.escape(template[pos:match.start()]) \
+                        + SEGMENT
+                    pos = match.end()
+                pattern += re.escape(template[pos:])
+                groups.append('(%s)(?=$|[/?;])' % pattern)
+                self.templates.append(template)
+            self.template = re.compile('^(?:%s)' % '|'.join(groups))
+
+        self.regex_rules = [
+            (re.compile(pattern), replacement)
+            for pattern, replacement in (regex_rules or [])
+        ]
+
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+
+    def _normalize(self, request):
+        if request == 'NULL' or request == '..reading..' \
+            or request.find(" ") == -1:
+            return None, None
+
+        #  split into method, path and protocol
+        match = REQUEST_LINE.match(request)
+        if match is None:
+            return None, None
+        method, path = match.groups()
+
+        #  take first 5 contexts
+        url_parts = path.strip().split(sep="/", maxsplit=6)
+        url = ''.join('/' + x for x in url_parts[1:5])
+
+        #  remove dynamic content. Cut after the rule occurrence which
+        #  ends first, same as applying the rules one by one
+        if self.substract is not None:
+            match = self.substract.search(url)
+            while match is not None:
+                url = url[:match.end()]
+                match = self.substract.search(url, 0, len(url) - 1)
+
+        if self.template is not None:
+            match = self.template.match(url)
+            if match is not None:
+                url = self.templates[match.lastindex - 1] \
+                    + url[match.end():]
+
+        for pattern, replacement in self.regex_rules:
+            url = pattern.sub(replacement, url)
+
+        return method, url
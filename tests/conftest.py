@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#  Modules of the exporter are imported the way application.py does,
+#  fixtures and stub server are shared with the benchmarks
+sys.path.insert(0, os.path.join(ROOT, 'src', 'prometheus-apache-exporter'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmark'))
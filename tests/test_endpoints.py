@@ -0,0 +1,72 @@
+import pytest
+
+from collector import Collector, StatusPage
+from config import load_config
+from endpoints import EndpointStats
+
+ENV = {
+    'APACHE_EXPORTER_URL': 'http://127.0.0.1:1/server-status',
+    'APACHE_EXPORTER_NAME': 'test',
+    'APACHE_URL_SUBSTRACT_RULES': '["?"]',
+    'APACHE_ENDPOINT_STATISTICS': 'true',
+    'APACHE_EXPORTER_MODULES': '["endpoints"]',
+}
+
+PAGE = (
+    '<html><body><table><tr><th>Srv</th><th>PID</th><th>Acc</th>'
+    '<th>M</th><th>CPU</th><th>Req</th><th>Request</th></tr>\n'
+    '<tr><td><b>0-0</b></td><td>100</td><td>%s</td><td>%s</td>'
+    '<td>0.00</td><td>%d</td><td nowrap>GET /api/users?id=1 HTTP/1.1</td>'
+    '</tr>\n</table></body></html>'
+)
+
+
+def collector(parser):
+    config, errors = load_config(dict(ENV, APACHE_EXPORTER_PARSER=parser))
+    assert not errors
+    return Collector(config=config)
+
+
+def scrape(collector, page):
+    """ Collect the page, return (count, sum) of the endpoint series """
+    if collector.config.parser == 'stream':
+        parser = collector.stream_parser(collector.modules)
+        parser.feed(page.encode())
+        status = StatusPage(None, None, parser.close(), None)
+    else:
+        status = StatusPage(page.encode(), None, None, None)
+    for family in collector.collect_page(status, 0):
+        if family.name == 'apache_endpoint_response_time_seconds':
+            values = dict((sample[0], sample[2]) for sample in family.samples)
+            return (values.get(family.name + '_count', 0),
+                    values.get(family.name + '_sum', 0))
+    raise AssertionError('no endpoint histogram')
+
+
+@pytest.mark.parametrize('parser', ['html', 'stream'])
+def test_running_request_is_observed_once_finished(parser):
+    c = collector(parser)
+    #  Request in flight: no duration yet
+    assert scrape(c, PAGE % ('0/1/1', 'W', 0)) == (0, 0)
+    #  Finished, slot accesses are incremented
+    assert scrape(c, PAGE % ('1/2/2', '_', 250)) == (1, 0.25)
+    #  Same request seen again while the worker is in keepalive
+    assert scrape(c, PAGE % ('1/2/2', 'K', 250)) == (1, 0.25)
+
+
+def test_rows_without_mode_column_are_observed():
+    c = collector('html')
+    page = PAGE.replace('<th>M</th>', '').replace('<td>%s</td><td>0.00',
+                                                  '<td>0.00')
+    assert scrape(c, page % ('0/1/1', 100)) == (1, 0.1)
+
+
+@pytest.mark.parametrize('max_series', [1, 2, 5])
+def test_overflow_series_counts_against_the_limit(max_series):
+    stats = EndpointStats(max_series=max_series)
+    for i in range(20):
+        stats.update([(('GET /%d' % i,), 'GET', '/%d' % i, 0.1)])
+    samples = stats.samples()
+    assert len(samples) == max_series
+    assert ('OTHER', 'other') in [(s[0], s[1]) for s in samples]
+    assert sum(s[2][-1][1] for s in samples) == 20
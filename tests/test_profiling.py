@@ -0,0 +1,54 @@
+import time
+import signal
+import threading
+
+import pytest
+import requests
+
+import fixtures
+from replay import StubApache
+from bench_startup import start_exporter, EXPORTER_URL
+
+
+@pytest.fixture
+def exporter():
+    stub = StubApache(fixtures.status_page(
+        *fixtures.SCENARIOS['small-prefork']
+    ))
+    process, _ = start_exporter({'APACHE_EXPORTER_URL': stub.url,
+                                 'APACHE_EXPORTER_PROFILING': 'true'})
+    yield
+    process.send_signal(signal.SIGTERM)
+    process.wait(10)
+    stub.stop()
+
+
+def test_profile_answers_after_the_scrapes(exporter):
+    responses = []
+
+    def profile():
+        responses.append(requests.get(
+            EXPORTER_URL + '/debug/profile?scrapes=2&timeout=30'
+        ))
+
+    profiler = threading.Thread(target=profile)
+    profiler.start()
+    #  Second session is rejected while the first one runs
+    time.sleep(0.5)
+    concurrent = requests.get(EXPORTER_URL + '/debug/profile?timeout=1')
+    assert concurrent.status_code == 409
+
+    start = time.perf_counter()
+    for _ in range(2):
+        requests.get(EXPORTER_URL + '/metrics').raise_for_status()
+    profiler.join(10)
+    assert time.perf_counter() - start < 10
+    assert responses[0].status_code == 200
+    assert responses[0].text.startswith('2 of 2 scrapes profiled')
+
+
+def test_profile_times_out(exporter):
+    start = time.perf_counter()
+    response = requests.get(EXPORTER_URL + '/debug/profile?timeout=0.2')
+    assert time.perf_counter() - start < 5
+    assert response.text.startswith('0 of 1 scrapes profiled')
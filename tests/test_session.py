@@ -0,0 +1,37 @@
+import pytest
+
+from replay import StubApache
+from session import PooledSession
+
+
+@pytest.fixture
+def stubs():
+    stubs = [StubApache(b'<html></html>') for _ in range(3)]
+    yield stubs
+    for stub in stubs:
+        stub.stop()
+
+
+def test_counters_of_closed_pools_are_kept(stubs):
+    """ The adapter keeps pools of two hosts, scrapes of a third one
+    close the least recently used pool """
+    session = PooledSession()
+    previous = (0, 0, 0)
+    for i in range(12):
+        session.get(stubs[i % 3].url)
+        stats = session.stats()
+        assert stats[0] == i + 1
+        assert all(now >= then for now, then in zip(stats, previous))
+        previous = stats
+    session.close()
+    assert session.stats() == previous
+
+
+def test_counters_are_carried_over_on_reload(stubs):
+    session = PooledSession()
+    for stub in stubs:
+        session.get(stub.url)
+    reloaded = PooledSession(previous=session)
+    session.close()
+    reloaded.get(stubs[0].url)
+    assert reloaded.stats()[0] == 4
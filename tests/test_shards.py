@@ -0,0 +1,76 @@
+import os
+import json
+import signal
+import tempfile
+
+import pytest
+import requests
+
+import fixtures
+from replay import StubApache
+from bench_startup import start_exporter, EXPORTER_URL
+from bench_targets import process_tree
+
+SCENARIO = 'small-prefork'
+
+
+def worker_errors(text, name):
+    """ Value of the worker stage of scrape errors of the target """
+    prefix = 'apache_exporter_scrape_errors_total{exporter_name="%s",' \
+        'stage="worker"} ' % name
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return None
+
+
+def down(text):
+    """ Lines of targets reported as apache_up 0 """
+    return [line for line in text.splitlines()
+            if line.startswith('apache_up{') and line.endswith(' 0.0')]
+
+
+@pytest.fixture
+def stub():
+    scenario = fixtures.SCENARIOS[SCENARIO]
+    stub = StubApache(fixtures.status_page(*scenario))
+    yield stub
+    stub.stop()
+
+
+def test_targets_of_a_stuck_worker_are_down(stub):
+    """ Workers which do not answer in time are reported as apache_up 0
+    and a worker error of every target they scrape """
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as targets:
+        json.dump([{'name': 'first', 'url': stub.url},
+                   {'name': 'second', 'url': stub.url + '?second'}], targets)
+        targets.flush()
+        process, _ = start_exporter({
+            'APACHE_EXPORTER_TARGETS': targets.name,
+            'APACHE_EXPORTER_PROCESSES': '2',
+            'APACHE_EXPORTER_TIMEOUT': '1',
+        })
+    workers = process_tree(process.pid)[1:]
+    try:
+        session = requests.Session()
+        #  Spawned workers may miss the first scrapes while they start
+        for _ in range(10):
+            before = session.get(EXPORTER_URL + '/metrics').text
+            if not down(before):
+                break
+        for pid in workers:
+            os.kill(pid, signal.SIGSTOP)
+        response = session.get(EXPORTER_URL + '/metrics')
+        ready = session.get(EXPORTER_URL + '/healthz/ready').status_code
+    finally:
+        for pid in workers:
+            os.kill(pid, signal.SIGCONT)
+        process.send_signal(signal.SIGTERM)
+        process.wait(10)
+
+    assert response.status_code == 200
+    assert len(down(response.text)) == 2
+    for name in ('first', 'second'):
+        assert worker_errors(response.text, name) \
+            == worker_errors(before, name) + 1
+    assert ready == 503
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from sizes import parse_size
+from collector import TOTALS_RE
+from bench_sizes import fuzz_sizes, fuzz_totals, fuzz_garbage
+
+FUZZ = 5000
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('512 ', 512),
+    ('5.2K', 5.2 * 2**10),
+    (' 10M', 10 * 2**20),
+    ('342 B', 342),
+    ('4.6 kB', 4.6 * 2**10),
+    ('5.6 GB', 5.6 * 2**30),
+    ('1.0 TB', 2**40),
+])
+def test_mod_status_sizes(text, expected):
+    assert parse_size(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', ' ', 'B', 'kB', '1.2.3 kB', '-1 B',
+                                  '5 XB', 'nan'])
+def test_invalid_sizes_raise_value_error(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
+
+
+@pytest.mark.parametrize('line, traffic', [
+    ('Total accesses: 10 - Total Traffic: 2.0 MB', '2.0 MB'),
+    ('Total accesses: 10 - Total Traffic: 2.0 MB - Total Duration: 5',
+     '2.0 MB'),
+])
+def test_totals_line_traffic(line, traffic):
+    assert TOTALS_RE.match(line).group(2) == traffic
+
+
+def test_printed_sizes_parse_back():
+    _, failures, _ = fuzz_sizes(random.Random(1), FUZZ)
+    assert failures == []
+
+
+def test_totals_lines_parse_back():
+    _, failures = fuzz_totals(random.Random(2), FUZZ)
+    assert failures == []
+
+
+def test_random_strings_parse_or_raise_value_error():
+    _, failures = fuzz_garbage(random.Random(3), FUZZ)
+    assert failures == []
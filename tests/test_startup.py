@@ -0,0 +1,59 @@
+import json
+import tempfile
+
+import pytest
+
+import fixtures
+from replay import StubApache, SUBSTRACT_RULES
+from bench_startup import check_mode, check_outage
+
+SCENARIO = 'small-prefork'
+MODES = {
+    'sync': ({}, 1),
+    'async': ({'APACHE_EXPORTER_ASYNC': 'true'}, 1),
+    'targets': ({'APACHE_EXPORTER_TARGETS': None}, 2),
+    'shards': ({'APACHE_EXPORTER_TARGETS': None,
+                'APACHE_EXPORTER_PROCESSES': '2'}, 2),
+}
+
+
+@pytest.fixture(scope='module')
+def stub():
+    scenario = fixtures.SCENARIOS[SCENARIO]
+    stub = StubApache(fixtures.status_page(*scenario),
+                      fixtures.auto_page(*scenario))
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture(scope='module')
+def env(stub):
+    return {
+        'APACHE_EXPORTER_URL': stub.url,
+        'APACHE_EXPORTER_NAME': SCENARIO,
+        'APACHE_URL_SUBSTRACT_RULES': json.dumps(SUBSTRACT_RULES),
+        'APACHE_ENDPOINT_STATISTICS': 'true',
+    }
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_every_scrape_fetches_every_target_once(mode, stub, env):
+    mode_env, count = MODES[mode]
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as targets:
+        json.dump([{'name': 'first', 'url': stub.url},
+                   {'name': 'second', 'url': stub.url + '?second'}], targets)
+        targets.flush()
+        mode_env = dict((key, value or targets.name)
+                        for key, value in mode_env.items())
+        result, failures = check_mode(mode, dict(env, **mode_env), count,
+                                      stub, 5)
+    assert result['startup_fetches'] == 0
+    assert result['fetches_per_scrape'] == 1
+    assert result['exit_code'] == 0
+    assert failures == []
+
+
+def test_outage_is_not_ready(env):
+    result, failures = check_outage(env, 5)
+    assert result['ready'] == 503
+    assert failures == []
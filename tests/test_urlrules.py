@@ -0,0 +1,19 @@
+import pytest
+
+from urlrules import UrlNormalizer
+
+
+@pytest.mark.parametrize('request_line, expected', [
+    ('GET /users/42 HTTP/1.1', ('GET', '/users/{id}')),
+    ('GET /users/42', ('GET', '/users/{id}')),
+    ('GET /users/42/orders/7?page=2 HTTP/2.0',
+     ('GET', '/users/{id}/orders/{order}?')),
+    ('POST /users/42;jsessionid=1 HTTP/1.0', ('POST', '/users/{id};')),
+    ('GET /static/img/1.png HTTP/1.1', ('GET', '/static/img/1.png')),
+    ('NULL', (None, None)),
+    ('..reading..', (None, None)),
+])
+def test_templates_match_the_path_only(request_line, expected):
+    normalizer = UrlNormalizer(['?', ';', ' HTTP'],
+                               ['/users/{id}/orders/{order}', '/users/{id}'])
+    assert normalizer.normalize(request_line) == expected